@@ -0,0 +1,306 @@
+# benchmark_chatbot.py
+import argparse
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+import tracemalloc
+import zlib
+from contextlib import redirect_stdout
+from io import StringIO
+
+import numpy as np
+
+from retrieval_index import InternedStrings, RetrievalIndex, StringTable
+from train_chatbot_new import create_training_data, load_training_data
+
+CARD_BRANDS = ["Visa", "Mastercard", "JCB", "Vietjet", "Petrolimex", "Priority", "Best Friend"]
+CARD_TIERS = ["Classic", "Gold", "Platinum", "Signature", "World", "Ultimate", "Standard"]
+BENEFITS = [
+    "Hoàn tiền {n}% cho chi tiêu ăn uống",
+    "Miễn phí {n} lượt phòng chờ sân bay mỗi năm",
+    "Tích {n} điểm thưởng cho mỗi 10.000 VNĐ chi tiêu",
+    "Trả góp 0% lãi suất kỳ hạn {n} tháng",
+    "Giảm {n}% khi mua vé máy bay"
+]
+
+
+class HashingEncoder:
+    """Deterministic offline stand-in for SentenceTransformer.encode.
+
+    Hashes character trigrams of each word into a fixed-size signed vector, so
+    similar strings get similar embeddings and no model download is needed.
+    """
+
+    def __init__(self, dim=256):
+        self.dim = dim
+
+    def encode(self, texts, batch_size=32, **kwargs):
+        single = isinstance(texts, str)
+        if single:
+            texts = [texts]
+        embeddings = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in text.lower().split():
+                padded = f"<{word}>"
+                for start in range(max(1, len(padded) - 2)):
+                    h = zlib.crc32(padded[start:start + 3].encode('utf-8'))
+                    embeddings[row, h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        return embeddings[0] if single else embeddings
+
+    def get_sentence_embedding_dimension(self):
+        return self.dim
+
+    @property
+    def cache_key(self):
+        # Identifies the embeddings in the bot's on-disk caches
+        return f"hashing-trigram-{self.dim}"
+
+
+def synthesize_cards(n_cards, seed=0):
+    """Card records in the scraped training_card_data.json format"""
+    rng = random.Random(seed)
+    cards = []
+    for idx in range(n_cards):
+        name = f"HDBank {rng.choice(CARD_BRANDS)} {rng.choice(CARD_TIERS)} {idx + 1}"
+        cards.append({
+            "metadata": {"card_name": name, "card_type": rng.choice(["credit", "debit"])},
+            "description": f"Thẻ {name} là thẻ thanh toán quốc tế với hạn mức đến {rng.randint(10, 500)} triệu đồng.",
+            "features": {
+                "benefits": [b.format(n=rng.randint(1, 20)) for b in rng.sample(BENEFITS, 3)],
+                "gifts": [f"Tặng {rng.randint(100, 500)}.000 VNĐ khi mở thẻ"],
+                "privileges": []
+            },
+            "terms_and_conditions": {
+                "conditions": f"Thu nhập tối thiểu {rng.randint(5, 30)} triệu đồng mỗi tháng",
+                "fees": f"Phí thường niên {rng.randint(1, 20) * 100}.000 VNĐ, lãi suất {rng.randint(20, 35)}%/năm",
+                "documents": "CMND/CCCD và chứng minh thu nhập"
+            },
+            "faqs": {
+                f"Hạn mức thẻ {name} là bao nhiêu?": f"Hạn mức từ {rng.randint(10, 50)} triệu đồng.",
+                "Làm sao để khóa thẻ khi bị mất?": "Gọi tổng đài 1900 6060 hoặc khóa trên ứng dụng HDBank."
+            }
+        })
+    return {"cards_data": cards}
+
+
+def make_queries(questions, n_queries, seed=0):
+    """Mix of verbatim, perturbed and unknown questions"""
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(n_queries):
+        question = rng.choice(questions)
+        kind = rng.random()
+        if kind < 0.4:
+            queries.append(question)
+        elif kind < 0.9:
+            words = question.split()
+            if len(words) > 2:
+                words.pop(rng.randrange(len(words)))
+            queries.append(" ".join(words).upper() if rng.random() < 0.2 else " ".join(words))
+        else:
+            queries.append(f"câu hỏi không liên quan số {rng.randint(0, 10 ** 6)}")
+    return queries
+
+
+def percentiles_ms(samples):
+    samples = np.asarray(samples) * 1000
+    return {f"p{q}_ms": float(np.percentile(samples, q)) for q in (50, 95, 99)}
+
+
+def timed(fn):
+    """(result, seconds) of one call"""
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def peak_memory(fn):
+    """Peak bytes allocated by Python during one call (run separately from timings,
+    since tracemalloc slows everything down)"""
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+
+def retained_memory(fn):
+    """Bytes still allocated by Python once fn has returned (its result kept alive)"""
+    tracemalloc.start()
+    try:
+        result = fn()
+        current, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    return current
+
+
+def memory_report(training_file, index_dir):
+    """Row-per-dict and list storage of the dataset against the interned, array-backed columns"""
+    def load_rows():
+        with open(training_file, 'r', encoding='utf-8') as f:
+            return json.load(f)['qa_pairs']
+
+    index = RetrievalIndex.load(index_dir, training_file, mmap=False)
+    return {
+        "unique_answers": len(index.answers.table),
+        "rows_as_dicts_mb": retained_memory(load_rows) / 2 ** 20,
+        "rows_interned_mb": retained_memory(lambda: load_training_data(training_file)) / 2 ** 20,
+        "questions_list_mb": retained_memory(lambda: [qa['question'] for qa in load_rows()]) / 2 ** 20,
+        "questions_column_mb": retained_memory(
+            lambda: StringTable.from_strings([qa['question'] for qa in load_rows()])) / 2 ** 20,
+        "answers_list_mb": retained_memory(lambda: [qa['answer'] for qa in load_rows()]) / 2 ** 20,
+        "answers_column_mb": retained_memory(
+            lambda: InternedStrings.from_strings([qa['answer'] for qa in load_rows()])) / 2 ** 20,
+        "index_mb": index.nbytes / 2 ** 20
+    }
+
+
+def holdout_split(qa_pairs, fraction=0.2, seed=0):
+    """(train, held_out): a share of the variations of each answer is held out as queries.
+
+    Every (card, answer) group keeps at least one training row, so each held-out
+    question has a correct answer in the index.
+    """
+    rng = random.Random(seed)
+    groups = {}
+    for qa in qa_pairs:
+        groups.setdefault((qa['metadata'].get('card_name'), qa['answer']), []).append(qa)
+    train, held_out = [], []
+    for rows in groups.values():
+        n_held = min(int(len(rows) * fraction), len(rows) - 1)
+        picked = set(rng.sample(range(len(rows)), n_held))
+        for idx, qa in enumerate(rows):
+            (held_out if idx in picked else train).append(qa)
+    return train, held_out
+
+
+def evaluate_index(index, held_out, threshold=0.3):
+    """Top-1 answer accuracy, rejection rate and per-query latency on held-out questions"""
+    correct = rejected = 0
+    latencies = []
+    for qa in held_out:
+        start = time.perf_counter()
+        rows, _ = index.search(index.vectorizer.transform([qa['question']]), 1, threshold)
+        latencies.append(time.perf_counter() - start)
+        if len(rows) == 0:
+            rejected += 1
+        elif index.answers[int(rows[0])] == qa['answer']:
+            correct += 1
+    return {
+        "accuracy": correct / len(held_out),
+        "rejection_rate": rejected / len(held_out),
+        "mean_ms": float(np.mean(latencies)) * 1000,
+        **percentiles_ms(latencies)
+    }
+
+
+def compaction_report(training_file, tolerances=(0.95, 0.9, 0.8), holdout=0.2, seed=0):
+    """Index size, query latency and held-out accuracy with and without compaction"""
+    train, held_out = holdout_split(load_training_data(training_file)['qa_pairs'], holdout, seed)
+    full = RetrievalIndex.fit(train)
+    report = []
+    for tolerance in (None,) + tuple(tolerances):
+        index, compact_s = timed(lambda: full.compact(tolerance)) if tolerance is not None else (full, 0.0)
+        report.append({
+            "tolerance": tolerance,
+            "rows": len(index.questions),
+            "index_mb": index.nbytes / 2 ** 20,
+            "compact_s": compact_s,
+            **evaluate_index(index, held_out)
+        })
+    return {"train_rows": len(train), "held_out": len(held_out), "indexes": report}
+
+
+def benchmark_bot(name, make_bot, queries):
+    bot, startup = timed(make_bot)
+
+    latencies = []
+    for query in queries:
+        _, elapsed = timed(lambda: bot.get_answer(query))
+        latencies.append(elapsed)
+
+    # Throughput over the whole query list, one call per query and through the
+    # batch API (caches already warm for repeats in both)
+    _, sequential = timed(lambda: [bot.get_answer(query) for query in queries])
+    _, batched = timed(lambda: list(bot.get_answers(queries)))
+
+    return {
+        "bot": name,
+        "startup_s": startup,
+        "startup_peak_mb": peak_memory(make_bot) / 2 ** 20,
+        "query_peak_mb": peak_memory(lambda: [bot.get_answer(q) for q in queries[:200]]) / 2 ** 20,
+        "throughput_qps": len(queries) / batched,
+        "sequential_qps": len(queries) / sequential,
+        **percentiles_ms(latencies)
+    }
+
+
+def run_benchmark(card_counts=(10, 100, 1000), n_queries=500, seed=0, work_dir=None):
+    from test_chatbot import EnhancedCardBot, SimpleCardBot
+
+    results = []
+    created = work_dir is None
+    if created:
+        work_dir = tempfile.mkdtemp(prefix="chatbot-bench-")
+    try:
+        for n_cards in card_counts:
+            np.random.seed(seed)
+            card_file = os.path.join(work_dir, f"cards_{n_cards}.json")
+            training_file = os.path.join(work_dir, f"training_{n_cards}.json")
+            index_dir = os.path.join(work_dir, f"index_{n_cards}")
+            with open(card_file, 'w', encoding='utf-8') as f:
+                json.dump(synthesize_cards(n_cards, seed), f, ensure_ascii=False)
+
+            with redirect_stdout(StringIO()):
+                _, build_time = timed(lambda: create_training_data(card_file, training_file))
+                build_peak = peak_memory(lambda: create_training_data(card_file, training_file))
+            with open(training_file, 'r', encoding='utf-8') as f:
+                questions = [qa['question'] for qa in json.load(f)['qa_pairs']]
+            queries = make_queries(questions, n_queries, seed)
+
+            # Write the on-disk index once so the "index" runs measure a warm start
+            SimpleCardBot(training_file, index_dir)
+            row = {
+                "cards": n_cards,
+                "qa_pairs": len(questions),
+                "build_training_data_s": build_time,
+                "build_peak_mb": build_peak / 2 ** 20,
+                "memory": memory_report(training_file, index_dir),
+                "compaction": compaction_report(training_file, seed=seed),
+                "bots": [
+                    benchmark_bot("simple (fit)", lambda: SimpleCardBot(training_file), queries),
+                    benchmark_bot("simple (index)", lambda: SimpleCardBot(training_file, index_dir), queries),
+                    benchmark_bot(
+                        "enhanced (stand-in encoder)",
+                        lambda: EnhancedCardBot(training_file, index_dir, encoder=HashingEncoder()),
+                        queries
+                    )
+                ]
+            }
+            results.append(row)
+            print(json.dumps(row, indent=4))
+    finally:
+        if created:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark SimpleCardBot and EnhancedCardBot on synthetic catalogs")
+    parser.add_argument('--cards', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="write all results to this JSON file")
+    args = parser.parse_args()
+
+    results = run_benchmark(args.cards, args.queries, args.seed)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=4)
@@ -0,0 +1,86 @@
+# card_catalog.py
+from collections import namedtuple
+
+CardEntry = namedtuple("CardEntry", [
+    "number", "name", "description", "benefits", "features", "conditions", "fees", "faqs"
+])
+
+# QA contexts written by generate_qa_pairs, and the CardEntry field each one fills
+CONTEXT_FIELDS = {
+    "card_description": "description",
+    "card_benefits": "benefits",
+    "card_features": "features",
+    "card_conditions": "conditions",
+    "card_fees": "fees"
+}
+
+
+def card_aliases(name):
+    """Lowercased ways of writing a card name: in full, and without the bank name"""
+    name = name.lower()
+    aliases = [name]
+    if name.startswith("hdbank "):
+        aliases.append(name[len("hdbank "):])
+    return aliases
+
+
+class CardCatalog:
+    """Per-card answers looked up by name, alias or menu number, built once from the index"""
+
+    def __init__(self, entries):
+        self.entries = list(entries)
+        self._by_alias = {}
+        for entry in self.entries:
+            for alias in card_aliases(entry.name):
+                self._by_alias.setdefault(alias, entry)
+
+    @classmethod
+    def from_index(cls, index):
+        """One entry per card with rows in the index, numbered in catalog order"""
+        cards = {}
+        for card_name, context, rows in index.partitions():
+            if card_name is None:
+                continue
+            fields = cards.setdefault(card_name, {"faqs": {}})
+            if context in CONTEXT_FIELDS:
+                fields[CONTEXT_FIELDS[context]] = index.answers[rows[0]]
+            elif context == "card_faqs":
+                # Each FAQ's rows are its variations, the original question first
+                seen = set()
+                for row in rows.tolist():
+                    answer_id = int(index.answers.ids[row])
+                    if answer_id not in seen:
+                        seen.add(answer_id)
+                        fields["faqs"][index.questions[row]] = index.answers[row]
+
+        # Card ids follow first appearance in the training data
+        names = [name for name in index.card_names if name in cards]
+        return cls(
+            CardEntry(number, name, **{field: cards[name].get(field) for field in CardEntry._fields[2:]})
+            for number, name in enumerate(names, 1)
+        )
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    @property
+    def names(self):
+        return [entry.name for entry in self.entries]
+
+    def get(self, name):
+        """Entry for a card name or alias (any case), or None"""
+        return self._by_alias.get(name.strip().lower())
+
+    def by_number(self, number):
+        """Entry for a 1-based menu number given as a string, or None"""
+        try:
+            idx = int(number) - 1
+        except ValueError:
+            return None
+        return self.entries[idx] if 0 <= idx < len(self.entries) else None
+
+    def menu(self):
+        return "\n".join(f"{entry.number}. Thẻ {entry.name}" for entry in self.entries)
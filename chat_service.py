@@ -0,0 +1,256 @@
+# chat_service.py
+import argparse
+import asyncio
+import json
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+class ServiceBusy(Exception):
+    """Raised when the encoder queue is full"""
+
+
+class MicroBatcher:
+    """Gather encode requests from concurrent users into micro-batches.
+
+    Each call takes one queue slot whatever its number of texts, and waits at
+    most max_wait seconds to be joined by other calls up to batch_size texts.
+    The batch is encoded on a dedicated worker thread, batch_size texts at a
+    time, so bulk calls (pattern embeddings, re-encoded rows) are split up there.
+    """
+
+    def __init__(self, encoder, batch_size=32, max_wait=0.005, queue_depth=1024):
+        self.encoder = encoder
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.queue = asyncio.Queue(maxsize=queue_depth)
+        self.loop = None
+        self.batches = 0
+        self.encoded = 0
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="encoder")
+        self._task = None
+
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        self._task = self.loop.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._executor.shutdown(wait=False)
+
+    async def encode(self, texts):
+        """Queue texts for encoding; raises ServiceBusy when the queue is full"""
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        future = self.loop.create_future()
+        try:
+            self.queue.put_nowait((list(texts), future))
+        except asyncio.QueueFull:
+            raise ServiceBusy("encoder queue is full")
+        return await future
+
+    def encode_blocking(self, texts):
+        """Called from bot worker threads: hand texts to the event loop and wait"""
+        return asyncio.run_coroutine_threadsafe(self.encode(list(texts)), self.loop).result()
+
+    async def _run(self):
+        while True:
+            batch = [await self.queue.get()]
+            size = len(batch[0][0])
+            deadline = self.loop.time() + self.max_wait
+            while size < self.batch_size:
+                timeout = deadline - self.loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+                size += len(batch[-1][0])
+
+            batch = [(texts, future) for texts, future in batch if not future.cancelled()]
+            if not batch:
+                continue
+            texts = [text for call_texts, _ in batch for text in call_texts]
+            try:
+                embeddings = await self.loop.run_in_executor(self._executor, self._encode_pieces, texts)
+            except Exception as exc:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(exc)
+                continue
+
+            self.encoded += len(texts)
+            start = 0
+            for call_texts, future in batch:
+                if not future.done():
+                    future.set_result(embeddings[start:start + len(call_texts)])
+                start += len(call_texts)
+
+    def _encode_pieces(self, texts):
+        pieces = []
+        for start in range(0, len(texts), self.batch_size):
+            pieces.append(np.asarray(self.encoder.encode(texts[start:start + self.batch_size])))
+            self.batches += 1
+        return np.concatenate(pieces)
+
+
+class BatchingEncoder:
+    """Drop-in for SentenceTransformer.encode that routes through a MicroBatcher"""
+
+    def __init__(self, batcher):
+        self.batcher = batcher
+
+    def encode(self, texts, **kwargs):
+        if isinstance(texts, str):
+            return self.batcher.encode_blocking([texts])[0]
+        return self.batcher.encode_blocking(texts)
+
+
+class ChatService:
+    """Line-protocol (one JSON object per line) chat server around one shared bot"""
+
+    def __init__(self, bot, batch_size=32, max_wait=0.005, queue_depth=1024, workers=8):
+        self.bot = bot
+        self.batcher = MicroBatcher(bot.encoder, batch_size, max_wait, queue_depth)
+        self.queue_depth = queue_depth
+        self.pending = 0
+        self.rejected = 0
+        self.errors = 0
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="chat")
+        self._server = None
+
+    async def start(self, host='127.0.0.1', port=8765):
+        self.batcher.start()
+        self.bot.encoder = BatchingEncoder(self.batcher)
+        self._server = await asyncio.start_server(self._handle_client, host, port)
+        return self._server
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+        self.bot.encoder = self.batcher.encoder
+        await self.batcher.stop()
+        self._executor.shutdown(wait=False)
+
+    async def answer(self, message, session_id=None):
+        if self.pending >= self.queue_depth:
+            raise ServiceBusy("too many pending requests")
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, self.bot.get_answer, message, session_id)
+        finally:
+            self.pending -= 1
+
+    async def _handle_client(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                start = time.perf_counter()
+                try:
+                    request = json.loads(line)
+                    message, session_id = request["message"], request.get("session_id")
+                    if not isinstance(message, str) or not isinstance(session_id, (str, type(None))):
+                        raise TypeError("message and session_id must be strings")
+                except (ValueError, KeyError, TypeError, AttributeError):
+                    reply = {"error": "bad_request"}
+                else:
+                    try:
+                        reply = {"answer": await self.answer(message, session_id)}
+                    except ServiceBusy as exc:
+                        self.rejected += 1
+                        reply = {"error": "busy", "detail": str(exc)}
+                    except Exception:
+                        # A failing request gets an error reply; the connection stays open
+                        self.errors += 1
+                        traceback.print_exc()
+                        reply = {"error": "internal"}
+                reply["latency_ms"] = (time.perf_counter() - start) * 1000
+                writer.write(json.dumps(reply, ensure_ascii=False).encode('utf-8') + b"\n")
+                await writer.drain()
+        finally:
+            writer.close()
+
+
+class ChatClient:
+    """Minimal client for the line protocol, for local testing"""
+
+    def __init__(self, host='127.0.0.1', port=8765):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        return self
+
+    async def ask(self, message, session_id=None):
+        request = {"message": message, "session_id": session_id}
+        self.writer.write(json.dumps(request, ensure_ascii=False).encode('utf-8') + b"\n")
+        await self.writer.drain()
+        return json.loads(await self.reader.readline())
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+
+async def serve(args):
+    from test_chatbot import EnhancedCardBot
+
+    bot = EnhancedCardBot(args.training_file, retrieval_mode=args.retrieval_mode,
+                          encoder_quantize=args.quantize_encoder, encoder_threads=args.encoder_threads,
+                          encoder_max_seq_length=args.max_seq_length)
+    bot.warm_up()
+    service = ChatService(bot, args.batch_size, args.max_wait_ms / 1000, args.queue_depth, args.workers)
+    server = await service.start(args.host, args.port)
+    print(f"ChatBot service listening on {args.host}:{args.port}")
+    async with server:
+        await server.serve_forever()
+
+
+async def chat(args):
+    client = await ChatClient(args.host, args.port).connect()
+    try:
+        reply = await client.ask(args.message, args.session_id)
+        print(reply.get("answer", reply))
+    finally:
+        await client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="HDBank card chatbot service")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    serve_parser = subparsers.add_parser('serve')
+    serve_parser.add_argument('--training-file', default='training_data.json')
+    serve_parser.add_argument('--retrieval-mode', default='tfidf')
+    serve_parser.add_argument('--batch-size', type=int, default=32)
+    serve_parser.add_argument('--max-wait-ms', type=float, default=5.0)
+    serve_parser.add_argument('--queue-depth', type=int, default=1024)
+    serve_parser.add_argument('--workers', type=int, default=8)
+    serve_parser.add_argument('--quantize-encoder', action='store_true', help="int8 dynamic quantization")
+    serve_parser.add_argument('--encoder-threads', type=int)
+    serve_parser.add_argument('--max-seq-length', type=int)
+
+    ask_parser = subparsers.add_parser('ask')
+    ask_parser.add_argument('message')
+    ask_parser.add_argument('--session-id')
+
+    args = parser.parse_args()
+    asyncio.run(serve(args) if args.command == 'serve' else chat(args))
@@ -0,0 +1,257 @@
+# dense_index.py
+import hashlib
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from retrieval_index import select_top_k, source_fingerprint
+
+DENSE_FORMAT_VERSION = 2
+
+
+def dense_index_path(training_file, rows=None, encoder_name=None):
+    """Embeddings live next to the dataset: training_data.json -> training_data.embeddings.<key>.f16.npy.
+
+    The key hashes the row fingerprint and encoder the embeddings line up with, so
+    bots over differently compacted or rebuilt indexes keep separate files.
+    """
+    base, _ = os.path.splitext(training_file)
+    key = hashlib.sha256(json.dumps([rows, encoder_name]).encode('utf-8')).hexdigest()[:16]
+    return f"{base}.embeddings.{key}.f16.npy"
+
+
+def normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class DenseIndex:
+    """Normalized float16 question embeddings with exact (blocked) and IVF search"""
+
+    def __init__(self, embeddings, meta=None, block_size=4096):
+        self.embeddings = embeddings
+        self.meta = meta or {}
+        self.block_size = block_size
+        # IVF structures, filled by build_ivf() or load()
+        self.centroids = None
+        self.list_rows = None
+        self.list_offsets = None
+
+    @classmethod
+    def build(cls, encode_texts, questions, batch_size=256):
+        """Embed every question in batches into a float16 matrix"""
+        questions = list(questions)
+        embeddings = None
+        for start in range(0, len(questions), batch_size):
+            batch = normalize_rows(encode_texts(questions[start:start + batch_size]))
+            if embeddings is None:
+                embeddings = np.zeros((len(questions), batch.shape[1]), dtype=np.float16)
+            embeddings[start:start + len(batch)] = batch
+        if embeddings is None:
+            embeddings = np.zeros((0, 0), dtype=np.float16)
+        return cls(embeddings)
+
+    def save(self, path, training_file=None, encoder_name=None, rows=None):
+        """rows identifies the question rows the embeddings line up with (RetrievalIndex.row_fingerprint).
+
+        Each file is written to a temporary name and moved into place, so processes
+        with the old files memory-mapped keep reading them; the metadata goes last.
+        """
+        tmp = f".tmp-{os.getpid()}"
+        np.save(path + tmp + '.npy', self.embeddings)
+        os.replace(path + tmp + '.npy', path)
+        meta = {
+            "format_version": DENSE_FORMAT_VERSION,
+            "encoder": encoder_name,
+            "source": source_fingerprint(training_file) if training_file else None,
+            "rows": rows,
+            "n_rows": int(self.embeddings.shape[0]),
+            "dim": int(self.embeddings.shape[1])
+        }
+        if self.centroids is not None:
+            np.savez(path + tmp + '.ivf.npz', centroids=self.centroids,
+                     list_rows=self.list_rows, list_offsets=self.list_offsets)
+            os.replace(path + tmp + '.ivf.npz', path + '.ivf.npz')
+        elif os.path.exists(path + '.ivf.npz'):
+            # Clusters from an older embedding matrix would be stale
+            os.remove(path + '.ivf.npz')
+        with open(path + tmp + '.json', 'w', encoding='utf-8') as f:
+            json.dump(meta, f, indent=4)
+        os.replace(path + tmp + '.json', path + '.json')
+        self.meta = meta
+        return meta
+
+    @classmethod
+    def load(cls, path, training_file=None, encoder_name=None, rows=None, n_rows=None):
+        """Memory-map saved embeddings, or return None if missing, stale or not aligned
+        with the given rows (fingerprint and count)"""
+        try:
+            with open(path + '.json', 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if meta.get("format_version") != DENSE_FORMAT_VERSION:
+            return None
+        if encoder_name and meta.get("encoder") != encoder_name:
+            return None
+        if rows and meta.get("rows") != rows:
+            return None
+        if training_file and os.path.exists(training_file):
+            if meta.get("source") != source_fingerprint(training_file):
+                return None
+
+        try:
+            index = cls(np.load(path, mmap_mode='r'), meta)
+        except (OSError, ValueError):
+            return None
+        if n_rows is not None and len(index) != n_rows:
+            return None
+        if os.path.exists(path + '.ivf.npz'):
+            with np.load(path + '.ivf.npz') as ivf:
+                index.centroids = ivf['centroids']
+                index.list_rows = ivf['list_rows']
+                index.list_offsets = ivf['list_offsets']
+        return index
+
+    def __len__(self):
+        return self.embeddings.shape[0]
+
+    @property
+    def nbytes(self):
+        total = self.embeddings.nbytes
+        if self.centroids is not None:
+            total += self.centroids.nbytes + self.list_rows.nbytes + self.list_offsets.nbytes
+        return total
+
+    def search(self, query_embedding, k=1, threshold=0.0, rows=None, stats=None):
+        """Exact search: score the matrix block by block, keeping a running top-k.
+
+        With rows, only those rows are scored. If a stats dict is given, the number of
+        candidate rows (the given rows, or block rows reaching threshold) is stored
+        under "candidates".
+        """
+        query = normalize_rows(np.asarray(query_embedding, dtype=np.float32).reshape(1, -1))[0]
+        if rows is not None:
+            rows = np.sort(np.asarray(rows, dtype=np.int64))
+            scores = np.asarray(self.embeddings[rows], dtype=np.float32) @ query
+            if stats is not None:
+                stats["candidates"] = len(rows)
+            keep = scores >= threshold
+            return select_top_k(rows[keep], scores[keep], k)
+        best_rows = np.zeros(0, dtype=np.int64)
+        best_scores = np.zeros(0, dtype=np.float32)
+
+        candidates = 0
+        for start in range(0, len(self), self.block_size):
+            block = np.asarray(self.embeddings[start:start + self.block_size], dtype=np.float32)
+            scores = block @ query
+            hits = np.flatnonzero(scores >= threshold)
+            candidates += len(hits)
+            if len(hits) == 0:
+                continue
+            best_rows, best_scores = select_top_k(
+                np.concatenate([best_rows, hits + start]),
+                np.concatenate([best_scores, scores[hits]]),
+                k
+            )
+        if stats is not None:
+            stats["candidates"] = candidates
+        return best_rows, best_scores
+
+    def build_ivf(self, n_lists=None, n_iter=10, seed=0):
+        """Cluster the embeddings with spherical k-means into inverted lists"""
+        n_rows = len(self)
+        n_lists = min(n_lists or max(1, int(np.sqrt(n_rows))), n_rows)
+        rng = np.random.RandomState(seed)
+        centroids = np.asarray(self.embeddings[np.sort(rng.choice(n_rows, n_lists, replace=False))], dtype=np.float32)
+
+        for _ in range(n_iter):
+            assignments = self._assign(centroids)
+            for c in range(n_lists):
+                members = np.flatnonzero(assignments == c)
+                if len(members):
+                    centroids[c] = np.asarray(self.embeddings[members], dtype=np.float32).mean(axis=0)
+            centroids = normalize_rows(centroids)
+
+        assignments = self._assign(centroids)
+        self.centroids = centroids
+        self.list_rows = np.argsort(assignments, kind='stable')
+        self.list_offsets = np.searchsorted(assignments[self.list_rows], np.arange(n_lists + 1))
+        return self
+
+    def _assign(self, centroids):
+        assignments = np.zeros(len(self), dtype=np.int64)
+        for start in range(0, len(self), self.block_size):
+            block = np.asarray(self.embeddings[start:start + self.block_size], dtype=np.float32)
+            assignments[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+        return assignments
+
+    def search_ivf(self, query_embedding, k=1, threshold=0.0, n_probe=4, stats=None):
+        """Approximate search over the n_probe closest clusters only (stats counts the probed rows)"""
+        if self.centroids is None:
+            self.build_ivf()
+        query = normalize_rows(np.asarray(query_embedding, dtype=np.float32).reshape(1, -1))[0]
+        closest = np.argsort(-(self.centroids @ query))[:n_probe]
+        rows = np.sort(np.concatenate([
+            self.list_rows[self.list_offsets[c]:self.list_offsets[c + 1]] for c in closest
+        ]))
+        scores = np.asarray(self.embeddings[rows], dtype=np.float32) @ query
+        if stats is not None:
+            stats["candidates"] = len(rows)
+        keep = scores >= threshold
+        return select_top_k(rows[keep], scores[keep], k)
+
+
+def percentile_ms(samples, q):
+    return float(np.percentile(np.asarray(samples) * 1000, q)) if samples else 0.0
+
+
+def compare_retrieval(bot, queries, k=1):
+    """Memory footprint and latency of TF-IDF vs dense retrieval on the same bot"""
+    tfidf = bot.index
+    tfidf_bytes = sum(
+        m.data.nbytes + m.indices.nbytes + m.indptr.nbytes
+        for m in (tfidf.question_vectors, tfidf.postings)
+    )
+    report = {"tfidf": {"index_bytes": int(tfidf_bytes)}}
+
+    def timed(fn):
+        samples = []
+        for query in queries:
+            start = time.perf_counter()
+            fn(query)
+            samples.append(time.perf_counter() - start)
+        return {"p50_ms": percentile_ms(samples, 50), "p99_ms": percentile_ms(samples, 99)}
+
+    report["tfidf"].update(timed(lambda q: bot.get_top_k(q, k)))
+
+    dense = bot.get_dense_index()
+    # Encode once up front so the numbers isolate the search itself
+    embeddings = dict(zip(queries, bot.encode_texts([bot.preprocess_text(q) for q in queries])))
+    report["dense"] = {"index_bytes": int(dense.embeddings.nbytes)}
+    report["dense"].update(timed(lambda q: dense.search(embeddings[q], k)))
+    if dense.centroids is None:
+        dense.build_ivf()
+    report["ivf"] = {"index_bytes": int(dense.nbytes)}
+    report["ivf"].update(timed(lambda q: dense.search_ivf(embeddings[q], k)))
+    return report
+
+
+if __name__ == "__main__":
+    from test_chatbot import EnhancedCardBot
+
+    training_file = sys.argv[1] if len(sys.argv) > 1 else 'training_data.json'
+    bot = EnhancedCardBot(training_file, retrieval_mode='dense')
+    index = bot.get_dense_index()
+    index.build_ivf()
+    path = dense_index_path(training_file, bot.index.row_fingerprint, bot.encoder_key)
+    index.save(path, training_file, bot.encoder_key, bot.index.row_fingerprint)
+    print(f"Saved {len(index)} question embeddings to {path}")
+
+    sample = list(bot.questions[:200])
+    print(json.dumps(compare_retrieval(bot, sample), indent=4))
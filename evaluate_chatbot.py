@@ -0,0 +1,228 @@
+# evaluate_chatbot.py
+import argparse
+import json
+import multiprocessing as mp
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from benchmark_chatbot import HashingEncoder, holdout_split, percentiles_ms
+from train_chatbot_new import generate_variations, load_training_data
+
+# Intent get_intent should find for a question generated from each QA context
+# (FAQ rows can be about anything, so they are not scored)
+CONTEXT_INTENTS = {
+    "card_description": "card_info",
+    "card_benefits": "benefits",
+    "card_features": "benefits",
+    "card_conditions": "requirements",
+    "card_fees": "fees",
+    "greeting": "greeting",
+    "farewell": "farewell"
+}
+
+# Report fields that must match for two runs' metrics to be comparable
+RUN_SETTINGS = ("bot", "retrieval_mode", "stand_in_encoder", "k", "holdout", "seed", "train_rows", "queries")
+
+_bot = None
+_options = None
+
+
+def paraphrase_queries(train, held_out, seed=0):
+    """[(query, answer, intent)]: each held-out question rewritten with the generate_variations rules.
+
+    A variation that is also a training question is never used, so every query
+    is unseen by the index; with no fresh variation the held-out question itself is.
+    """
+    rng = random.Random(seed)
+    seen = {qa['question'].lower() for qa in train}
+    queries = []
+    for qa in held_out:
+        fresh = [v for v in generate_variations(qa['question']) if v.lower() not in seen]
+        queries.append((rng.choice(fresh) if fresh else qa['question'], qa['answer'],
+                        CONTEXT_INTENTS.get(qa.get('context'))))
+    return queries
+
+
+def _init_worker(training_file, index_dir, options):
+    global _bot, _options
+    from test_chatbot import EnhancedCardBot, SimpleCardBot
+
+    _options = options
+    if options["bot"] == "enhanced":
+        encoder = HashingEncoder() if options["stand_in_encoder"] else None
+        _bot = EnhancedCardBot(training_file, index_dir, retrieval_mode=options["retrieval_mode"], encoder=encoder)
+    else:
+        _bot = SimpleCardBot(training_file, index_dir)
+
+
+def _evaluate_chunk(chunk):
+    """Per query: (top-1 correct, top-k correct, intent correct or None, rejected, seconds).
+
+    Top-k and rejection (nothing above similarity_threshold) are measured on the
+    TF-IDF candidates; top-1 on the bot's own reply.
+    """
+    from test_chatbot import SimpleCardBot
+
+    enhanced = _options["bot"] == "enhanced"
+    results = []
+    for idx, (query, answer, intent) in chunk:
+        start = time.perf_counter()
+        # One session per query, so no context carries over between unrelated questions
+        reply = _bot.get_answer(query, f"eval-{idx}") if enhanced else _bot.get_answer(query)
+        elapsed = time.perf_counter() - start
+
+        matches = SimpleCardBot.get_top_k(_bot, query, _options["k"])
+        reply = reply["answer"] if isinstance(reply, dict) else reply
+        intent_correct = None
+        if enhanced and intent:
+            text = _bot.preprocess_text(query).lower()
+            hits = _bot.keyword_matcher.find_all(text)
+            predicted = _bot.get_intent(text, hits)
+            # A multi-intent match is right when the expected intent is one of its parts
+            if predicted == "multi_intent":
+                intent_correct = intent in {hit.value for hit in hits if hit.category == "intent"}
+            else:
+                intent_correct = predicted == intent
+        results.append((
+            reply == answer,
+            any(match["answer"] == answer for match in matches),
+            intent_correct,
+            not matches,
+            elapsed
+        ))
+    return results
+
+
+def evaluate(training_file='training_data.json', bot="simple", retrieval_mode="tfidf", stand_in_encoder=False,
+             holdout=0.1, max_queries=None, k=5, workers=None, seed=0, chunk_size=64):
+    """Hold out a slice of the QA variations, fit on the rest and replay paraphrases of the held-out slice"""
+    from test_chatbot import SimpleCardBot
+
+    train, held_out = holdout_split(load_training_data(training_file)['qa_pairs'], holdout, seed)
+    queries = paraphrase_queries(train, held_out, seed)
+    if max_queries and len(queries) > max_queries:
+        queries = random.Random(seed).sample(queries, max_queries)
+
+    workers = workers or os.cpu_count()
+    options = {"bot": bot, "retrieval_mode": retrieval_mode, "stand_in_encoder": stand_in_encoder, "k": k}
+    work_dir = tempfile.mkdtemp(prefix="chatbot-eval-")
+    try:
+        train_file = os.path.join(work_dir, "train.json")
+        index_dir = os.path.join(work_dir, "index")
+        with open(train_file, 'w', encoding='utf-8') as f:
+            json.dump({"qa_pairs": train}, f, ensure_ascii=False)
+        # Fit and save once; the workers memory-map the same index
+        SimpleCardBot(train_file, index_dir)
+
+        items = list(enumerate(queries))
+        chunks = [items[start:start + chunk_size] for start in range(0, len(items), chunk_size)]
+        start = time.perf_counter()
+        with mp.get_context('fork').Pool(workers, _init_worker, (train_file, index_dir, options)) as pool:
+            results = [r for chunk in pool.imap(_evaluate_chunk, chunks) for r in chunk]
+        elapsed = time.perf_counter() - start
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    top1, topk, intents, rejected, latencies = zip(*results)
+    scored_intents = [correct for correct in intents if correct is not None]
+    return {
+        "bot": bot,
+        "retrieval_mode": retrieval_mode if bot == "enhanced" else "tfidf",
+        "stand_in_encoder": stand_in_encoder if bot == "enhanced" else False,
+        "k": k,
+        "holdout": holdout,
+        "seed": seed,
+        "train_rows": len(train),
+        "queries": len(queries),
+        "top1_accuracy": float(np.mean(top1)),
+        f"top{k}_accuracy": float(np.mean(topk)),
+        "intent_accuracy": float(np.mean(scored_intents)) if scored_intents else None,
+        "rejection_rate": float(np.mean(rejected)),
+        "mean_ms": float(np.mean(latencies)) * 1000,
+        **percentiles_ms(latencies),
+        "workers": workers,
+        "wall_s": elapsed
+    }
+
+
+def baseline_mismatches(report, baseline):
+    """RUN_SETTINGS that differ between report and baseline, as readable strings"""
+    return [
+        f"{name} is {report.get(name)!r}, baseline has {baseline.get(name)!r}"
+        for name in RUN_SETTINGS if report.get(name) != baseline.get(name)
+    ]
+
+
+def compare_to_baseline(report, baseline, max_accuracy_drop=0.01, max_rejection_increase=0.01,
+                        max_latency_increase=0.25):
+    """Regressions of report against a stored baseline, as readable strings (empty if none).
+
+    A baseline from a run with other RUN_SETTINGS is not compared at all; each
+    differing setting is reported instead. Latencies are per query inside a
+    worker, so they are only compared when both runs used the same number of workers.
+    """
+    mismatches = baseline_mismatches(report, baseline)
+    if mismatches:
+        return [f"not comparable: {mismatch}" for mismatch in mismatches]
+
+    regressions = []
+    same_pool = report.get("workers") == baseline.get("workers")
+    for name, value in report.items():
+        old = baseline.get(name)
+        if value is None or old is None:
+            continue
+        if name.endswith("_accuracy") and value < old - max_accuracy_drop:
+            regressions.append(f"{name} dropped from {old:.4f} to {value:.4f}")
+        elif name == "rejection_rate" and value > old + max_rejection_increase:
+            regressions.append(f"{name} rose from {old:.4f} to {value:.4f}")
+        elif same_pool and name in ("p50_ms", "p95_ms") and value > old * (1 + max_latency_increase):
+            regressions.append(f"{name} rose from {old:.2f} to {value:.2f}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline accuracy and latency evaluation on held-out variations")
+    parser.add_argument('--training-file', default='training_data.json')
+    parser.add_argument('--bot', choices=['simple', 'enhanced'], default='simple')
+    parser.add_argument('--retrieval-mode', default='tfidf')
+    parser.add_argument('--stand-in-encoder', action='store_true',
+                        help="use the offline hashing encoder instead of the sentence model")
+    parser.add_argument('--holdout', type=float, default=0.1)
+    parser.add_argument('--max-queries', type=int)
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--baseline', help="compare against this report and exit 1 on regression or different run settings")
+    parser.add_argument('--save-baseline', help="write the report here as the new baseline")
+    parser.add_argument('--max-accuracy-drop', type=float, default=0.01)
+    parser.add_argument('--max-rejection-increase', type=float, default=0.01)
+    parser.add_argument('--max-latency-increase', type=float, default=0.25)
+    args = parser.parse_args()
+
+    report = evaluate(args.training_file, args.bot, args.retrieval_mode, args.stand_in_encoder, args.holdout,
+                      args.max_queries, args.k, args.workers, args.seed)
+    print(json.dumps(report, indent=4))
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=4)
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        mismatches = baseline_mismatches(report, baseline)
+        for mismatch in mismatches:
+            print(f"BASELINE MISMATCH: {mismatch}", file=sys.stderr)
+        if mismatches:
+            sys.exit(1)
+        regressions = compare_to_baseline(report, baseline, args.max_accuracy_drop, args.max_rejection_increase,
+                                          args.max_latency_increase)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,65 @@
+# keyword_matcher.py
+from collections import deque, namedtuple
+
+KeywordHit = namedtuple("KeywordHit", ["start", "end", "pattern", "category", "value"])
+
+
+class KeywordMatcher:
+    """Aho-Corasick automaton: find every pattern occurrence in one pass over the text"""
+
+    def __init__(self):
+        self._goto = [{}]
+        self._fail = [0]
+        self._patterns = [[]]
+        self._outputs = [[]]
+        self._built = False
+
+    def add(self, pattern, category, value=None):
+        """Register a pattern; value defaults to the pattern itself"""
+        if not pattern:
+            return
+        state = 0
+        for char in pattern:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._patterns.append([])
+            state = next_state
+        self._patterns[state].append((pattern, category, pattern if value is None else value))
+        self._built = False
+
+    def build(self):
+        """Compute failure links breadth-first and merge their outputs"""
+        self._outputs = [list(patterns) for patterns in self._patterns]
+        queue = deque(self._goto[0].values())
+        for state in queue:
+            self._fail[state] = 0
+        while queue:
+            state = queue.popleft()
+            for char, child in self._goto[state].items():
+                queue.append(child)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0)
+                self._outputs[child] = self._outputs[child] + self._outputs[self._fail[child]]
+        self._built = True
+        return self
+
+    def find_all(self, text):
+        """Return every KeywordHit in text, ordered by end position"""
+        if not self._built:
+            self.build()
+        goto, fail, outputs = self._goto, self._fail, self._outputs
+        hits = []
+        state = 0
+        for position, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for pattern, category, value in outputs[state]:
+                hits.append(KeywordHit(position + 1 - len(pattern), position + 1, pattern, category, value))
+        return hits
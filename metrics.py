@@ -0,0 +1,201 @@
+# metrics.py
+import json
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager, nullcontext
+
+# Histogram upper bounds; stage timings are recorded in milliseconds
+DEFAULT_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000)
+
+# Counters that are also summarized per request (e.g. encoder calls per message)
+PER_REQUEST_COUNTERS = ("encoder_calls", "retrieval_candidates")
+
+_NULL_CONTEXT = nullcontext()
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for idx, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            idx = len(self.buckets)
+        self.counts[idx] += 1
+        self.total += value
+        self.count += 1
+
+    def to_dict(self):
+        return {
+            "buckets": list(self.buckets),
+            "counts": list(self.counts),
+            "sum": self.total,
+            "count": self.count
+        }
+
+
+class SlowRequestSampler:
+    """Samples the stacks of requests running longer than threshold_ms"""
+
+    def __init__(self, threshold_ms, interval=0.005, on_slow_request=None, keep=20):
+        self.threshold = threshold_ms / 1000
+        self.interval = interval
+        self.on_slow_request = on_slow_request
+        self.reports = deque(maxlen=keep)
+        self._active = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def begin(self):
+        ident = threading.get_ident()
+        with self._lock:
+            self._active[ident] = (time.perf_counter(), Counter())
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="slow-request-sampler", daemon=True)
+                self._thread.start()
+        return ident
+
+    def end(self, ident, duration):
+        with self._lock:
+            _, samples = self._active.pop(ident, (None, Counter()))
+        if duration < self.threshold:
+            return None
+        report = {
+            "duration_ms": duration * 1000,
+            "samples": dict(samples.most_common())
+        }
+        self.reports.append(report)
+        if self.on_slow_request:
+            self.on_slow_request(report)
+        return report
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            now = time.perf_counter()
+            with self._lock:
+                slow = [(ident, samples) for ident, (start, samples) in self._active.items()
+                        if now - start >= self.threshold]
+            if not slow:
+                continue
+            frames = sys._current_frames()
+            for ident, samples in slow:
+                frame = frames.get(ident)
+                stack = []
+                while frame is not None:
+                    stack.append(f"{frame.f_code.co_name}:{frame.f_lineno}")
+                    frame = frame.f_back
+                if stack:
+                    samples[";".join(reversed(stack))] += 1
+
+
+class Metrics:
+    """Per-stage timing histograms and counters; a cheap no-op when disabled"""
+
+    def __init__(self, enabled=False, prefix="chatbot", slow_request_ms=None, on_slow_request=None,
+                 sample_interval=0.005):
+        self.enabled = enabled
+        self.prefix = prefix
+        self.histograms = {}
+        self.counters = Counter()
+        self.sampler = None
+        if slow_request_ms is not None:
+            self.sampler = SlowRequestSampler(slow_request_ms, sample_interval, on_slow_request)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def stage(self, name):
+        """Context manager timing one stage into the "<name>" histogram"""
+        if not self.enabled:
+            return _NULL_CONTEXT
+        return self._timed(name)
+
+    @contextmanager
+    def _timed(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(f"stage_{name}_ms", (time.perf_counter() - start) * 1000)
+
+    @contextmanager
+    def request(self):
+        """Wrap one get_answer call: total latency, per-request counts, slow-request sampling"""
+        if not self.enabled:
+            yield
+            return
+        self._local.counts = Counter()
+        ident = self.sampler.begin() if self.sampler else None
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            self.observe("request_ms", duration * 1000)
+            self.count("requests")
+            counts, self._local.counts = self._local.counts, None
+            for name in PER_REQUEST_COUNTERS:
+                self.observe(f"{name}_per_request", counts.get(name, 0), COUNT_BUCKETS)
+            if self.sampler:
+                self.sampler.end(ident, duration)
+
+    def count(self, name, value=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] += value
+        counts = getattr(self._local, "counts", None)
+        if counts is not None:
+            counts[name] += value
+
+    def observe(self, name, value, buckets=DEFAULT_BUCKETS):
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram(buckets)
+            histogram.observe(value)
+
+    def export_prometheus(self, gauges=None):
+        """Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            for name, value in sorted(self.counters.items()):
+                metric = f"{self.prefix}_{name}_total"
+                lines += [f"# TYPE {metric} counter", f"{metric} {value}"]
+            for name, histogram in sorted(self.histograms.items()):
+                metric = f"{self.prefix}_{name}"
+                lines.append(f"# TYPE {metric} histogram")
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f'{metric}_bucket{{le="{bound}"}} {cumulative}')
+                lines.append(f'{metric}_bucket{{le="+Inf"}} {histogram.count}')
+                lines.append(f"{metric}_sum {histogram.total}")
+                lines.append(f"{metric}_count {histogram.count}")
+        for name, value in sorted((gauges or {}).items()):
+            metric = f"{self.prefix}_{name}"
+            lines += [f"# TYPE {metric} gauge", f"{metric} {value}"]
+        return "\n".join(lines) + "\n"
+
+    def export_jsonl(self, gauges=None):
+        """One JSON object per metric, one per line"""
+        timestamp = time.time()
+        records = []
+        with self._lock:
+            for name, value in sorted(self.counters.items()):
+                records.append({"ts": timestamp, "type": "counter", "name": name, "value": value})
+            for name, histogram in sorted(self.histograms.items()):
+                records.append({"ts": timestamp, "type": "histogram", "name": name, **histogram.to_dict()})
+        for name, value in sorted((gauges or {}).items()):
+            records.append({"ts": timestamp, "type": "gauge", "name": name, "value": value})
+        return "".join(json.dumps(record) + "\n" for record in records)
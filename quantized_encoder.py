@@ -0,0 +1,142 @@
+# quantized_encoder.py
+import argparse
+import io
+import json
+import random
+import sys
+import time
+
+import numpy as np
+
+from dense_index import normalize_rows
+
+
+def encoder_key(name, quantize=False, max_seq_length=None):
+    """Identifies the embeddings an encoder setup produces, for the on-disk caches"""
+    key = name
+    if quantize:
+        key += "+int8"
+    if max_seq_length:
+        key += f"@{max_seq_length}"
+    return key
+
+
+def load_sentence_encoder(name, quantize=False, threads=None, max_seq_length=None):
+    """SentenceTransformer on CPU, optionally int8 dynamically quantized.
+
+    Dynamic quantization stores the weights of every nn.Linear as int8 and
+    quantizes activations on the fly, which is where most of the CPU time of a
+    BERT-style encoder goes. threads sets torch's intra-op thread count and
+    max_seq_length truncates the tokens (chat messages are short). name can be
+    a local model directory, so no download is needed.
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    if threads:
+        torch.set_num_threads(threads)
+    model = SentenceTransformer(name, device='cpu')
+    if max_seq_length:
+        model.max_seq_length = max_seq_length
+    if quantize:
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    return model
+
+
+def model_size_mb(model):
+    """Size of the serialized weights (quantized layers store packed int8 weights)"""
+    import torch
+
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell() / 2 ** 20
+
+
+def encode_latency(encode_texts, texts, batch_size=64):
+    """Single-message latency percentiles and batch throughput of an encoder"""
+    encode_texts(texts[:8])  # warm up
+    latencies = []
+    for text in texts:
+        start = time.perf_counter()
+        encode_texts([text])
+        latencies.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    for offset in range(0, len(texts), batch_size):
+        encode_texts(texts[offset:offset + batch_size])
+    elapsed = time.perf_counter() - start
+    samples = np.asarray(latencies) * 1000
+    return {
+        **{f"p{q}_ms": float(np.percentile(samples, q)) for q in (50, 95, 99)},
+        "batch_texts_per_second": len(texts) / elapsed
+    }
+
+
+def nearest_rows(encode_texts, corpus, queries):
+    """Row of the most similar corpus text for each query"""
+    return np.argmax(normalize_rows(encode_texts(queries)) @ normalize_rows(encode_texts(corpus)).T, axis=1)
+
+
+def compare_encoders(training_file='training_data.json', index_dir=None, model=None, threads=None,
+                     max_seq_length=None, n_corpus=2000, n_queries=500, seed=0):
+    """Agreement, latency and model size of the int8 encoder against the fp32 one.
+
+    Intent agreement compares get_intents on perturbed dataset questions; retrieval
+    agreement compares the answer of the nearest question in a sample of the
+    generated rows.
+    """
+    from benchmark_chatbot import make_queries
+    from test_chatbot import EnhancedCardBot
+
+    bots = {}
+    for quantize in (False, True):
+        bot = EnhancedCardBot(training_file, index_dir, fast_path=False, encoder_name=model,
+                              encoder_quantize=quantize, encoder_threads=threads,
+                              encoder_max_seq_length=max_seq_length)
+        bots["int8" if quantize else "fp32"] = bot
+    reference, candidate = bots["fp32"], bots["int8"]
+
+    rng = random.Random(seed)
+    rows = rng.sample(range(len(reference.questions)), min(n_corpus, len(reference.questions)))
+    corpus = [reference.preprocess_text(reference.questions[row]) for row in rows]
+    answers = [reference.answers[row] for row in rows]
+    queries = [reference.preprocess_text(q) for q in make_queries(corpus, n_queries, seed)]
+
+    report = {"model": reference.encoder_name, "threads": threads, "max_seq_length": max_seq_length}
+    for name, bot in bots.items():
+        start = time.perf_counter()
+        bot.encoder
+        report[name] = {
+            "load_s": time.perf_counter() - start,
+            "model_mb": model_size_mb(bot.encoder),
+            **encode_latency(bot.encode_texts, queries)
+        }
+    report["intent_agreement"] = float(np.mean(
+        [a == b for a, b in zip(reference.get_intents(queries), candidate.get_intents(queries))]
+    ))
+    matches = zip(*(nearest_rows(bot.encode_texts, corpus, queries) for bot in (reference, candidate)))
+    report["retrieval_agreement"] = float(np.mean([answers[a] == answers[b] for a, b in matches]))
+    embeddings = [normalize_rows(bot.encode_texts(queries)) for bot in (reference, candidate)]
+    report["mean_cosine_to_fp32"] = float(np.mean(np.sum(embeddings[0] * embeddings[1], axis=1)))
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Accuracy gate and benchmark for the int8 quantized encoder")
+    parser.add_argument('--training-file', default='training_data.json')
+    parser.add_argument('--index-dir')
+    parser.add_argument('--model', help="model name or local directory (default: EnhancedCardBot.encoder_name)")
+    parser.add_argument('--threads', type=int)
+    parser.add_argument('--max-seq-length', type=int)
+    parser.add_argument('--corpus', type=int, default=2000)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--min-intent-agreement', type=float, default=0.97)
+    parser.add_argument('--min-retrieval-agreement', type=float, default=0.95)
+    args = parser.parse_args()
+
+    report = compare_encoders(args.training_file, args.index_dir, args.model, args.threads,
+                              args.max_seq_length, args.corpus, args.queries)
+    print(json.dumps(report, indent=4))
+    if (report["intent_agreement"] < args.min_intent_agreement
+            or report["retrieval_agreement"] < args.min_retrieval_agreement):
+        print("int8 encoder disagrees with fp32 beyond the gate", file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,577 @@
+# retrieval_index.py
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+from collections import Counter
+
+import numpy as np
+from scipy.sparse import csr_matrix, vstack
+
+INDEX_FORMAT_VERSION = 5
+MANIFEST_FILE = 'manifest.json'
+
+
+class StringTable:
+    """Read-only list of strings stored as one utf-8 blob plus an offsets array"""
+    __slots__ = ("blob", "offsets")
+
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    @classmethod
+    def from_strings(cls, strings):
+        encoded = [s.encode('utf-8') for s in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+        blob = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+        return cls(blob, offsets)
+
+    @classmethod
+    def load(cls, prefix, mmap=True):
+        offsets = np.load(prefix + '.offsets.npy', mmap_mode='r' if mmap else None)
+        if os.path.getsize(prefix + '.bin') == 0:
+            blob = np.zeros(0, dtype=np.uint8)
+        elif mmap:
+            blob = np.memmap(prefix + '.bin', dtype=np.uint8, mode='r')
+        else:
+            blob = np.fromfile(prefix + '.bin', dtype=np.uint8)
+        return cls(blob, offsets)
+
+    @classmethod
+    def concat(cls, tables):
+        blob = np.concatenate([np.asarray(t.blob, dtype=np.uint8) for t in tables])
+        offsets = np.zeros(sum(len(t) for t in tables) + 1, dtype=np.int64)
+        start, base = 1, 0
+        for t in tables:
+            offsets[start:start + len(t)] = np.asarray(t.offsets[1:]) - t.offsets[0] + base
+            start += len(t)
+            base += int(t.offsets[-1] - t.offsets[0])
+        return cls(blob, offsets)
+
+    def take(self, rows):
+        """New table holding the given rows, gathered without decoding them"""
+        rows = np.asarray(rows, dtype=np.int64)
+        starts = np.asarray(self.offsets[:-1])[rows]
+        lengths = np.diff(self.offsets)[rows]
+        offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        positions = np.repeat(starts - offsets[:-1], lengths) + np.arange(offsets[-1])
+        return type(self)(np.asarray(self.blob)[positions], offsets)
+
+    def digest(self):
+        """sha256 of the strings and their order"""
+        digest = hashlib.sha256(np.asarray(self.offsets, dtype=np.int64).tobytes())
+        digest.update(np.asarray(self.blob, dtype=np.uint8).tobytes())
+        return digest.hexdigest()
+
+    def save(self, prefix):
+        np.save(prefix + '.offsets.npy', self.offsets)
+        with open(prefix + '.bin', 'wb') as f:
+            f.write(self.blob.tobytes())
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @property
+    def nbytes(self):
+        return self.blob.nbytes + self.offsets.nbytes
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError('StringTable index out of range')
+        start, end = int(self.offsets[idx]), int(self.offsets[idx + 1])
+        return self.blob[start:end].tobytes().decode('utf-8')
+
+    def __iter__(self):
+        # One bytes copy of the blob instead of an array slice per string
+        data = self.blob.tobytes()
+        offsets = self.offsets.tolist()
+        for start, end in zip(offsets, offsets[1:]):
+            yield data[start:end].decode('utf-8')
+
+
+class FrozenTfidfVectorizer:
+    """transform() of a fitted default TfidfVectorizer, without importing sklearn.
+
+    Matches TfidfVectorizer() defaults: lowercasing, the default token pattern,
+    raw term counts times idf, then L2 row normalization.
+    """
+    token_pattern = re.compile(r"(?u)\b\w\w+\b")
+
+    def __init__(self, vocabulary, idf):
+        self.vocabulary_ = vocabulary
+        self.idf_ = np.asarray(idf, dtype=np.float64)
+
+    @classmethod
+    def from_sklearn(cls, vectorizer):
+        return cls({term: int(idx) for term, idx in vectorizer.vocabulary_.items()}, vectorizer.idf_)
+
+    def extend(self, texts, n_documents):
+        """Copy with the terms first seen in texts appended to the vocabulary.
+
+        A new term occurs only in texts, so its smoothed idf over n_documents is
+        exactly what a full refit would give; known terms keep their idf.
+        """
+        df = Counter()
+        for text in texts:
+            df.update({token for token in self.token_pattern.findall(text.lower())
+                       if token not in self.vocabulary_})
+        vocabulary = dict(self.vocabulary_)
+        new_idf = []
+        for term, count in df.items():
+            vocabulary[term] = len(vocabulary)
+            new_idf.append(np.log((1 + n_documents) / (1 + count)) + 1)
+        return type(self)(vocabulary, np.concatenate([self.idf_, new_idf]))
+
+    def transform(self, texts):
+        indptr = [0]
+        indices = []
+        for text in texts:
+            for token in self.token_pattern.findall(text.lower()):
+                idx = self.vocabulary_.get(token)
+                if idx is not None:
+                    indices.append(idx)
+            indptr.append(len(indices))
+
+        indices = np.asarray(indices, dtype=np.int32)
+        data = self.idf_[indices] if len(indices) else np.zeros(0)
+        matrix = csr_matrix((data, indices, np.asarray(indptr)), shape=(len(indptr) - 1, len(self.idf_)))
+        # Repeated tokens are summed into term counts
+        matrix.sum_duplicates()
+
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+        norms[norms == 0] = 1.0
+        matrix.data /= np.repeat(norms, np.diff(matrix.indptr))
+        return matrix
+
+
+def source_fingerprint(path):
+    """Cheap staleness key for the training file (size and modification time)"""
+    if os.path.isdir(path):
+        # Shard directories are rewritten as a whole, manifest included
+        path = os.path.join(path, MANIFEST_FILE)
+    stat = os.stat(path)
+    return {"path": os.path.abspath(path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def select_top_k(rows, scores, k):
+    """Partial selection of the k best (row, score) pairs, best first.
+
+    Ties are broken towards the lowest row, matching np.argmax over a full row.
+    """
+    if len(rows) > k:
+        kth = np.partition(scores, len(scores) - k)[len(scores) - k]
+        above = np.flatnonzero(scores > kth)
+        ties = np.flatnonzero(scores == kth)
+        ties = ties[np.argsort(rows[ties], kind='stable')][:k - len(above)]
+        selected = np.concatenate([above, ties])
+        rows, scores = rows[selected], scores[selected]
+
+    order = np.lexsort((rows, -scores))
+    return rows[order], scores[order]
+
+
+class InternedStrings:
+    """Column of strings stored once each in a StringTable and referenced by int32 ids.
+
+    Used for answers, which every variation of a question repeats verbatim.
+    """
+    __slots__ = ("table", "ids")
+
+    def __init__(self, table, ids):
+        self.table = table
+        self.ids = ids
+
+    @classmethod
+    def from_strings(cls, strings):
+        return cls(StringTable.from_strings([]), np.zeros(0, dtype=np.int32)).extend(strings)
+
+    def extend(self, strings):
+        """New column with strings appended, reusing the ids of strings already stored"""
+        positions = {string: idx for idx, string in enumerate(self.table)}
+        known = len(positions)
+        new_ids = np.array([positions.setdefault(string, len(positions)) for string in strings], dtype=np.int32)
+        table = StringTable.concat([self.table, StringTable.from_strings(list(positions)[known:])])
+        return type(self)(table, np.concatenate([np.asarray(self.ids, dtype=np.int32), new_ids]))
+
+    def take(self, rows):
+        """New column holding the given rows, dropping strings no longer referenced"""
+        used, ids = np.unique(np.asarray(self.ids)[rows], return_inverse=True)
+        return type(self)(self.table.take(used), ids.astype(np.int32).ravel())
+
+    def save(self, prefix):
+        self.table.save(prefix)
+        np.save(prefix + '.ids.npy', np.asarray(self.ids, dtype=np.int32))
+
+    @classmethod
+    def load(cls, prefix, mmap=True):
+        return cls(StringTable.load(prefix, mmap), np.load(prefix + '.ids.npy', mmap_mode='r' if mmap else None))
+
+    @property
+    def nbytes(self):
+        return self.table.nbytes + self.ids.nbytes
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        return self.table[int(self.ids[idx])]
+
+    def __iter__(self):
+        strings = list(self.table)
+        for idx in np.asarray(self.ids).tolist():
+            yield strings[idx]
+
+
+def as_string_table(strings):
+    return strings if isinstance(strings, StringTable) else StringTable.from_strings(strings)
+
+
+def intern_labels(labels, names=None):
+    """(ids, names): int32 id per label (-1 for None) into names, which is extended as needed"""
+    names = list(names or [])
+    positions = {name: idx for idx, name in enumerate(names)}
+    ids = np.array([
+        positions.setdefault(label, len(positions)) if label is not None else -1 for label in labels
+    ], dtype=np.int32)
+    return ids, list(positions)
+
+
+class RetrievalIndex:
+    """Fitted TF-IDF vocabulary, question matrix and answer table"""
+
+    def __init__(self, vectorizer, question_vectors, questions, answers, manifest=None, postings=None,
+                 row_cards=None, card_names=None, card_keys=None, row_contexts=None, context_names=None,
+                 compact_tolerance=None):
+        self.vectorizer = vectorizer
+        self.question_vectors = question_vectors
+        self.questions = questions
+        self.answers = answers
+        self.manifest = manifest or {}
+        # Row metadata as int ids into small name tables: which card each row was
+        # generated from (so one card's rows can be replaced) and its QA context
+        self.row_cards = row_cards if row_cards is not None else np.full(len(questions), -1, dtype=np.int32)
+        self.card_names = card_names or []
+        self.row_contexts = row_contexts if row_contexts is not None else np.full(len(questions), -1, dtype=np.int32)
+        self.context_names = context_names or []
+        # Content keys of the cards the rows were generated from, when the source records them
+        self.card_keys = card_keys
+        # Similarity tolerance near-duplicate rows were dropped with (None if never compacted)
+        self.compact_tolerance = compact_tolerance
+        # Inverted index: row t lists the questions containing term t
+        self.postings = postings if postings is not None else csr_matrix(question_vectors.T)
+        # Rows grouped by (card, context), built on first scoped search
+        self._partitions = None
+        self._row_fingerprint = self.manifest.get("row_fingerprint")
+
+    @property
+    def nbytes(self):
+        """Bytes held by the question/answer columns, row metadata and both sparse matrices"""
+        matrices = (csr_matrix(self.question_vectors), self.postings)
+        return (as_string_table(self.questions).nbytes + self.answers.nbytes
+                + self.row_cards.nbytes + self.row_contexts.nbytes
+                + sum(m.data.nbytes + m.indices.nbytes + m.indptr.nbytes for m in matrices))
+
+    @property
+    def row_fingerprint(self):
+        """Row count and a hash of the questions in row order, for artifacts aligned with the
+        rows (an incremental refresh and a full refit of the same data order rows differently)"""
+        if self._row_fingerprint is None:
+            questions = as_string_table(self.questions)
+            self._row_fingerprint = f"{len(questions)}:{questions.digest()[:32]}"
+        return self._row_fingerprint
+
+    def get_partitions(self):
+        """(order, cards, contexts, card_ids): rows sorted by (card, context), their sorted ids, name -> id"""
+        if self._partitions is None:
+            row_cards, row_contexts = np.asarray(self.row_cards), np.asarray(self.row_contexts)
+            # lexsort is stable, so rows stay ascending within each (card, context) run
+            order = np.lexsort((row_contexts, row_cards))
+            card_ids = {name: idx for idx, name in enumerate(self.card_names)}
+            self._partitions = (order, row_cards[order], row_contexts[order], card_ids)
+        return self._partitions
+
+    def partitions(self):
+        """Yield (card_name, context_name, rows) for every run of rows sharing a card and context"""
+        order, cards, contexts, _ = self.get_partitions()
+        if len(order) == 0:
+            return
+        bounds = (np.flatnonzero((np.diff(cards) != 0) | (np.diff(contexts) != 0)) + 1).tolist()
+        for start, end in zip([0] + bounds, bounds + [len(order)]):
+            card, context = int(cards[start]), int(contexts[start])
+            yield (self.card_names[card] if card >= 0 else None,
+                   self.context_names[context] if context >= 0 else None,
+                   order[start:end])
+
+    def card_rows(self, card_name, contexts=None):
+        """Rows generated from card_name, optionally only those with the given QA contexts.
+
+        Returns None if the index has no rows for the card.
+        """
+        order, sorted_cards, sorted_contexts, card_ids = self.get_partitions()
+
+        card = card_ids.get(card_name)
+        if card is None:
+            return None
+        start, end = np.searchsorted(sorted_cards, [card, card + 1])
+        if start == end:
+            return None
+        if contexts is None:
+            return order[start:end]
+        # Within a card the rows are sorted by context, so each context is one run
+        context_ids = [self.context_names.index(c) for c in contexts if c in self.context_names]
+        runs = [np.searchsorted(sorted_contexts[start:end], [c, c + 1]) + start for c in context_ids]
+        return np.concatenate([order[lo:hi] for lo, hi in runs] or [np.zeros(0, dtype=order.dtype)])
+
+    def search(self, query_vector, k=1, threshold=0.0, stats=None, rows=None):
+        """Return (rows, scores) of the k best questions scoring at least threshold.
+
+        TF-IDF rows are L2-normalized, so the cosine is a plain dot product and only
+        questions sharing a term with the query can score above zero. If a stats dict
+        is given, the number of scored candidate rows is stored under "candidates".
+        With rows (e.g. from card_rows), only those rows are scored.
+        """
+        query_vector = csr_matrix(query_vector)
+        empty = np.zeros(0, dtype=np.int64), np.zeros(0)
+        if query_vector.nnz == 0 or k <= 0:
+            return empty
+
+        if rows is not None:
+            rows = np.asarray(rows, dtype=np.int64)
+            scores = (csr_matrix(self.question_vectors)[rows] @ query_vector.T).toarray().ravel()
+            if stats is not None:
+                stats["candidates"] = len(rows)
+            keep = (scores > 0) & (scores >= threshold)
+            return select_top_k(rows[keep], scores[keep], k)
+
+        postings = self.postings
+        row_chunks, score_chunks = [], []
+        for term, weight in zip(query_vector.indices, query_vector.data):
+            start, end = postings.indptr[term], postings.indptr[term + 1]
+            row_chunks.append(postings.indices[start:end])
+            score_chunks.append(postings.data[start:end] * weight)
+        rows = np.concatenate(row_chunks)
+        if len(rows) == 0:
+            return empty
+
+        # Accumulate per candidate row (np.unique returns them in ascending order)
+        candidates, inverse = np.unique(rows, return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(score_chunks))
+        if stats is not None:
+            stats["candidates"] = len(candidates)
+
+        keep = scores >= threshold
+        return select_top_k(candidates[keep], scores[keep], k)
+
+    def rows_excluding(self, card_names):
+        """Rows not generated from any of the given cards"""
+        excluded = [idx for idx, name in enumerate(self.card_names) if name in card_names]
+        return np.flatnonzero(~np.isin(self.row_cards, excluded))
+
+    def replace_cards(self, updates, card_keys=None):
+        """New index with each card's rows replaced by updates[card_name] (empty removes the card).
+
+        Nothing is refit: kept rows reuse their vectors and the vocabulary is only
+        extended, so known terms keep their idf until the next full build. Kept
+        rows stay in order and the new rows are appended after them.
+        """
+        keep = self.rows_excluding(updates)
+        new_pairs = [qa for qa_pairs in updates.values() for qa in qa_pairs]
+        new_questions = [qa['question'] for qa in new_pairs]
+
+        vectorizer = self.vectorizer.extend(new_questions, len(keep) + len(new_pairs))
+        n_features = len(vectorizer.idf_)
+        kept = csr_matrix(self.question_vectors)[keep]
+        kept = csr_matrix((kept.data, kept.indices, kept.indptr), shape=(len(keep), n_features))
+        question_vectors = vstack([kept, vectorizer.transform(new_questions)], format='csr')
+
+        questions = StringTable.concat([
+            as_string_table(self.questions).take(keep), StringTable.from_strings(new_questions)
+        ])
+        answers = self.answers.take(keep).extend([qa['answer'] for qa in new_pairs])
+        new_cards, card_names = intern_labels((qa['metadata'].get('card_name') for qa in new_pairs), self.card_names)
+        new_contexts, context_names = intern_labels((qa.get('context') for qa in new_pairs), self.context_names)
+        return type(self)(vectorizer, question_vectors, questions, answers,
+                          row_cards=np.concatenate([np.asarray(self.row_cards)[keep], new_cards]),
+                          card_names=card_names, card_keys=card_keys,
+                          row_contexts=np.concatenate([np.asarray(self.row_contexts)[keep], new_contexts]),
+                          context_names=context_names)
+
+    def take(self, rows):
+        """New index with only the given rows, in that order (vocabulary and idf unchanged)"""
+        rows = np.asarray(rows, dtype=np.int64)
+        return type(self)(self.vectorizer, csr_matrix(self.question_vectors)[rows],
+                          as_string_table(self.questions).take(rows), self.answers.take(rows),
+                          row_cards=np.asarray(self.row_cards)[rows], card_names=self.card_names,
+                          card_keys=self.card_keys, row_contexts=np.asarray(self.row_contexts)[rows],
+                          context_names=self.context_names, compact_tolerance=self.compact_tolerance)
+
+    def compact(self, tolerance=0.9, rows=None):
+        """New index without near-duplicate questions.
+
+        generate_variations turns each base question into many rows that differ
+        only by a polite prefix or a synonym. Rows from the same card with the same
+        answer are scanned in order, and a row is dropped when its cosine to a row
+        already kept in the group is at least tolerance: it could only ever return
+        the answer of that row. With rows, only those rows are considered and the
+        others are all kept (e.g. just the rows appended by replace_cards).
+        Kept rows stay in order.
+        """
+        vectors = csr_matrix(self.question_vectors)
+        candidates = np.arange(vectors.shape[0]) if rows is None else np.asarray(rows, dtype=np.int64)
+        answer_ids = np.asarray(self.answers.ids)[candidates]
+        cards = np.asarray(self.row_cards)[candidates]
+        # Stable, so each (answer, card) group keeps its rows ascending
+        order = np.lexsort((cards, answer_ids))
+        bounds = np.flatnonzero((np.diff(answer_ids[order]) != 0) | (np.diff(cards[order]) != 0)) + 1
+
+        dropped = []
+        for group in np.split(candidates[order], bounds):
+            if len(group) < 2:
+                continue
+            similarity = (vectors[group] @ vectors[group].T).toarray()
+            kept = [0]
+            for row in range(1, len(group)):
+                if similarity[row, kept].max() >= tolerance:
+                    dropped.append(group[row])
+                else:
+                    kept.append(row)
+
+        index = self.take(np.setdiff1d(np.arange(vectors.shape[0]), dropped))
+        index.compact_tolerance = tolerance
+        return index
+
+    @classmethod
+    def fit(cls, qa_pairs, card_keys=None):
+        questions = [qa['question'] for qa in qa_pairs]
+        answers = [qa['answer'] for qa in qa_pairs]
+        # sklearn is only needed to fit; serving uses the frozen vocabulary and idf
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        vectorizer = TfidfVectorizer()
+        question_vectors = vectorizer.fit_transform(questions)
+        row_cards, card_names = intern_labels(qa.get('metadata', {}).get('card_name') for qa in qa_pairs)
+        row_contexts, context_names = intern_labels(qa.get('context') for qa in qa_pairs)
+        return cls(FrozenTfidfVectorizer.from_sklearn(vectorizer), question_vectors,
+                   StringTable.from_strings(questions), InternedStrings.from_strings(answers),
+                   row_cards=row_cards, card_names=card_names, card_keys=card_keys,
+                   row_contexts=row_contexts, context_names=context_names)
+
+    def save(self, index_dir, training_file=None):
+        """Write the index as a versioned directory of .npy/.bin files"""
+        tmp_dir = f"{index_dir.rstrip(os.sep)}.tmp-{os.getpid()}"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+
+        matrix = csr_matrix(self.question_vectors)
+        np.save(os.path.join(tmp_dir, 'data.npy'), matrix.data)
+        np.save(os.path.join(tmp_dir, 'indices.npy'), matrix.indices)
+        np.save(os.path.join(tmp_dir, 'indptr.npy'), matrix.indptr)
+        np.save(os.path.join(tmp_dir, 'postings_data.npy'), self.postings.data)
+        np.save(os.path.join(tmp_dir, 'postings_indices.npy'), self.postings.indices)
+        np.save(os.path.join(tmp_dir, 'postings_indptr.npy'), self.postings.indptr)
+        np.save(os.path.join(tmp_dir, 'idf.npy'), self.vectorizer.idf_)
+        np.save(os.path.join(tmp_dir, 'row_cards.npy'), np.asarray(self.row_cards, dtype=np.int32))
+        np.save(os.path.join(tmp_dir, 'row_contexts.npy'), np.asarray(self.row_contexts, dtype=np.int32))
+        with open(os.path.join(tmp_dir, 'vocabulary.json'), 'w', encoding='utf-8') as f:
+            json.dump({term: int(idx) for term, idx in self.vectorizer.vocabulary_.items()}, f, ensure_ascii=False)
+        as_string_table(self.questions).save(os.path.join(tmp_dir, 'questions'))
+        self.answers.save(os.path.join(tmp_dir, 'answers'))
+
+        manifest = {
+            "format_version": INDEX_FORMAT_VERSION,
+            "source": source_fingerprint(training_file) if training_file else None,
+            "n_rows": matrix.shape[0],
+            "n_features": matrix.shape[1],
+            "card_names": self.card_names,
+            "context_names": self.context_names,
+            "card_keys": self.card_keys,
+            "compact_tolerance": self.compact_tolerance,
+            "row_fingerprint": self.row_fingerprint
+        }
+        with open(os.path.join(tmp_dir, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=4)
+
+        # Swap the finished directory in so readers never see a half-written index
+        if os.path.isdir(index_dir):
+            shutil.rmtree(index_dir)
+        os.rename(tmp_dir, index_dir)
+        self.manifest = manifest
+        return manifest
+
+    @classmethod
+    def load(cls, index_dir, training_file=None, mmap=True):
+        """Open a saved index, or return None if it is missing or stale"""
+        try:
+            with open(os.path.join(index_dir, MANIFEST_FILE), 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if manifest.get("format_version") != INDEX_FORMAT_VERSION:
+            return None
+        if training_file and os.path.exists(training_file):
+            if manifest.get("source") != source_fingerprint(training_file):
+                return None
+
+        mmap_mode = 'r' if mmap else None
+        try:
+            data = np.load(os.path.join(index_dir, 'data.npy'), mmap_mode=mmap_mode)
+            indices = np.load(os.path.join(index_dir, 'indices.npy'), mmap_mode=mmap_mode)
+            indptr = np.load(os.path.join(index_dir, 'indptr.npy'), mmap_mode=mmap_mode)
+            postings_arrays = tuple(
+                np.load(os.path.join(index_dir, f'postings_{name}.npy'), mmap_mode=mmap_mode)
+                for name in ('data', 'indices', 'indptr')
+            )
+            idf = np.load(os.path.join(index_dir, 'idf.npy'))
+            row_cards = np.load(os.path.join(index_dir, 'row_cards.npy'), mmap_mode=mmap_mode)
+            row_contexts = np.load(os.path.join(index_dir, 'row_contexts.npy'), mmap_mode=mmap_mode)
+            with open(os.path.join(index_dir, 'vocabulary.json'), 'r', encoding='utf-8') as f:
+                vocabulary = json.load(f)
+            questions = StringTable.load(os.path.join(index_dir, 'questions'), mmap=mmap)
+            answers = InternedStrings.load(os.path.join(index_dir, 'answers'), mmap=mmap)
+        except (OSError, ValueError):
+            return None
+
+        # Rebuild a fitted vectorizer without refitting
+        vectorizer = FrozenTfidfVectorizer(vocabulary, idf)
+
+        question_vectors = csr_matrix(
+            (data, indices, indptr),
+            shape=(manifest["n_rows"], manifest["n_features"]),
+            copy=False
+        )
+        postings = csr_matrix(
+            postings_arrays,
+            shape=(manifest["n_features"], manifest["n_rows"]),
+            copy=False
+        )
+        return cls(vectorizer, question_vectors, questions, answers, manifest, postings,
+                   row_cards, manifest.get("card_names"), manifest.get("card_keys"),
+                   row_contexts, manifest.get("context_names"), manifest.get("compact_tolerance"))
+
+
+def build_index(training_file='training_data.json', index_dir='training_index', compact_tolerance=None):
+    """Offline step: fit the TF-IDF index (optionally compacted) and write it to index_dir"""
+    from train_chatbot_new import load_card_keys, load_training_data
+    index = RetrievalIndex.fit(load_training_data(training_file)['qa_pairs'], load_card_keys(training_file))
+    if compact_tolerance is not None:
+        n_rows = len(index.questions)
+        index = index.compact(compact_tolerance)
+        print(f"Compacted {n_rows} questions to {len(index.questions)} at tolerance {compact_tolerance}")
+    manifest = index.save(index_dir, training_file)
+    print(f"Built index with {manifest['n_rows']} questions and {manifest['n_features']} terms in {index_dir}")
+    return manifest
+
+
+if __name__ == "__main__":
+    build_index(*sys.argv[1:3], *(float(arg) for arg in sys.argv[3:4]))
@@ -0,0 +1,118 @@
+# session_store.py
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+
+# Rough fixed cost of a session (state object, dicts, deques) on top of its turns
+SESSION_OVERHEAD_BYTES = 1024
+TURN_OVERHEAD_BYTES = 256
+
+
+class SessionState:
+    """Lightweight per-user conversation state"""
+    __slots__ = ("session_id", "context", "history", "last_access", "size")
+
+    def __init__(self, session_id, max_turns=5):
+        self.session_id = session_id
+        self.context = {
+            "current_card": None,
+            "last_intent": None,
+            "questions_asked": deque(maxlen=max_turns)
+        }
+        # Ring buffer of the most recent turns
+        self.history = deque(maxlen=max_turns)
+        self.last_access = time.monotonic()
+        self.size = SESSION_OVERHEAD_BYTES
+
+    def add_turn(self, turn):
+        """Append a turn and return the change in estimated size"""
+        before = self.size
+        self.history.append(turn)
+        self.size = SESSION_OVERHEAD_BYTES + sum(estimate_turn_size(t) for t in self.history)
+        return self.size - before
+
+
+def estimate_turn_size(turn):
+    return TURN_OVERHEAD_BYTES + sum(
+        sys.getsizeof(value) for value in turn.values() if isinstance(value, str)
+    )
+
+
+class SessionStore:
+    """Session id -> SessionState with TTL expiry, LRU eviction and a memory cap"""
+
+    def __init__(self, max_sessions=10000, ttl=1800, max_turns=5, max_bytes=64 * 1024 * 1024):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.max_turns = max_turns
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __contains__(self, session_id):
+        return session_id in self._sessions
+
+    def get(self, session_id):
+        """Return the state for session_id, creating it if needed"""
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            state = self._sessions.get(session_id)
+            if state is None:
+                state = SessionState(session_id, self.max_turns)
+                self._sessions[session_id] = state
+                self.total_bytes += state.size
+            else:
+                self._sessions.move_to_end(session_id)
+            state.last_access = now
+            self._enforce_limits(keep=session_id)
+            return state
+
+    def record_turn(self, state, turn):
+        """Add a turn to a session, evicting older sessions if over the memory cap"""
+        with self._lock:
+            delta = state.add_turn(turn)
+            if self._sessions.get(state.session_id) is state:
+                self.total_bytes += delta
+                self._enforce_limits(keep=state.session_id)
+
+    def remove(self, session_id):
+        with self._lock:
+            state = self._sessions.pop(session_id, None)
+            if state is not None:
+                self.total_bytes -= state.size
+
+    def stats(self):
+        return {
+            "sessions": len(self._sessions),
+            "total_bytes": self.total_bytes,
+            "evictions": self.evictions,
+            "expirations": self.expirations
+        }
+
+    def _expire(self, now):
+        # Sessions are kept in access order, so expired ones are at the front
+        while self._sessions:
+            session_id, state = next(iter(self._sessions.items()))
+            if now - state.last_access < self.ttl:
+                break
+            self._sessions.popitem(last=False)
+            self.total_bytes -= state.size
+            self.expirations += 1
+
+    def _enforce_limits(self, keep=None):
+        while len(self._sessions) > 1 and (
+            len(self._sessions) > self.max_sessions or self.total_bytes > self.max_bytes
+        ):
+            # Oldest session other than the one in use (which need not be the newest)
+            session_id = next(sid for sid in self._sessions if sid != keep)
+            state = self._sessions.pop(session_id)
+            self.total_bytes -= state.size
+            self.evictions += 1
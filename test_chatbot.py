@@ -1,86 +1,308 @@
 # test_chatbot.py
+import time
+_import_start = time.perf_counter()
+
+import hashlib
 import json
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
 import numpy as np
-from transformers import AutoTokenizer, AutoModelForSequenceClassification
-from sentence_transformers import SentenceTransformer
-import torch
+import os
 import re
+import threading
+from contextlib import contextmanager
 from datetime import datetime
+from itertools import islice
+from retrieval_index import RetrievalIndex, select_top_k
+from dense_index import DenseIndex, dense_index_path, normalize_rows
+from session_store import SessionState, SessionStore
+from train_chatbot_new import load_card_keys, load_card_qa_pairs, load_training_data
+from keyword_matcher import KeywordMatcher
+from card_catalog import CardCatalog, card_aliases
+from response_cache import ResponseCache
+from metrics import Metrics
+from quantized_encoder import encoder_key, load_sentence_encoder
+from collections import namedtuple
+
+# torch / sentence_transformers are only imported when the encoder is first needed
+MODULE_IMPORT_SECONDS = time.perf_counter() - _import_start
+
+# card is the card named in the question; answer_card the card the answer row belongs to
+FastPathEntry = namedtuple("FastPathEntry", ["kind", "answer", "intent", "card", "answer_card"], defaults=(None,))
+# Saved next to the index files; RetrievalIndex.save() replaces the directory, dropping it
+FAST_PATH_FILE = "fast_path.npz"
+FAST_PATH_FORMAT_VERSION = 1
+
+
+def iter_chunks(items, chunk_size):
+    """Yield lists of up to chunk_size items from any iterable"""
+    iterator = iter(items)
+    while True:
+        chunk = list(islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class StartupProfile:
+    """Wall-clock seconds per startup stage (imports, index load, model load, ...)"""
+
+    def __init__(self):
+        self.stages = [("import test_chatbot", MODULE_IMPORT_SECONDS)]
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages.append((name, time.perf_counter() - start))
+
+    def total(self):
+        return sum(seconds for _, seconds in self.stages)
+
+    def report(self):
+        lines = [f"{name:<32}{seconds * 1000:>10.1f} ms" for name, seconds in self.stages]
+        lines.append(f"{'total':<32}{self.total() * 1000:>10.1f} ms")
+        return "\n".join(lines)
+
 
 class SimpleCardBot:
-    def __init__(self, training_file='training_data.json'):
-        # Load training data
-        with open(training_file, 'r', encoding='utf-8') as f:
-            self.training_data = json.load(f)
-        
-        # Initialize vectorizer
-        self.vectorizer = TfidfVectorizer()
-        
-        # Prepare questions and answers
-        self.questions = [qa['question'] for qa in self.training_data['qa_pairs']]
-        self.answers = [qa['answer'] for qa in self.training_data['qa_pairs']]
-        
-        # Fit vectorizer
-        self.question_vectors = self.vectorizer.fit_transform(self.questions)
+    similarity_threshold = 0.3
+    # A card carried over from earlier turns wins only if its best row scores within
+    # this margin of the best row overall (a near-tie)
+    card_preference_margin = 0.05
+
+    def __init__(self, training_file='training_data.json', index_dir=None, metrics=None, compact_tolerance=None):
+        self.training_file = training_file
+        self.index_dir = index_dir
+        # Near-duplicate question rows are dropped at this cosine (RetrievalIndex.compact).
+        # None takes whatever the saved index was built with, and fits uncompacted.
+        self.compact_tolerance = compact_tolerance
+        # Per-stage timings and counters; disabled (near zero overhead) by default
+        self.metrics = metrics if metrics is not None else Metrics()
+        self._training_data = None
+        self.startup_profile = StartupProfile()
+
+        # Open the prebuilt (memory-mapped) index, fitting only if it is missing or stale
+        with self.startup_profile.stage("load index"):
+            self.index = RetrievalIndex.load(index_dir, training_file) if index_dir else None
+        if self.index is not None:
+            if compact_tolerance is None:
+                self.compact_tolerance = self.index.compact_tolerance
+            elif self.index.compact_tolerance != compact_tolerance:
+                self.index = None
+        if self.index is None:
+            with self.startup_profile.stage("fit index"):
+                # Fit from a local copy: the row dicts are not needed once the columns exist
+                qa_pairs = load_training_data(training_file)['qa_pairs']
+                self.index = self.fit_index(qa_pairs, load_card_keys(training_file))
+                del qa_pairs
+                if index_dir:
+                    self.index.save(index_dir, training_file)
+        # Bumped whenever the index or training data is replaced, so caches can invalidate
+        self.data_version = 0
+        self.use_index(self.index)
+
+    def fit_index(self, qa_pairs, card_keys=None):
+        index = RetrievalIndex.fit(qa_pairs, card_keys)
+        if self.compact_tolerance is not None:
+            index = index.compact(self.compact_tolerance)
+        return index
+
+    def use_index(self, index):
+        self.index = index
+        self.vectorizer = index.vectorizer
+        self.questions = index.questions
+        self.answers = index.answers
+        self.question_vectors = index.question_vectors
+
+    def replace_index(self, index, kept_rows=None):
+        """Swap in a new index; kept_rows are the old rows it starts with, if built incrementally"""
+        self.use_index(index)
+        self.data_version += 1
+        self._training_data = None
+        if self.index_dir:
+            self.index.save(self.index_dir, self.training_file)
+
+    def update_cards(self, updates, card_keys=None):
+        """Replace the rows of the cards in updates ({card_name: qa_pairs}) without refitting"""
+        kept_rows = self.index.rows_excluding(updates)
+        index = self.index.replace_cards(updates, card_keys)
+        if self.compact_tolerance is not None:
+            # Kept rows were compacted already; only the appended rows need it
+            index = index.compact(self.compact_tolerance, np.arange(len(kept_rows), len(index.questions)))
+        self.replace_index(index, kept_rows)
+
+    def refresh(self):
+        """Catch up with a rebuilt training file, replacing only the rows of changed cards.
+
+        Incremental only for shard directories from create_training_shards, which
+        record a content key per card; otherwise the index is refit. Returns the
+        names of the replaced cards, or None after a full refit.
+        """
+        card_keys = load_card_keys(self.training_file)
+        old_keys = self.index.card_keys
+        if card_keys is None or old_keys is None:
+            self.replace_index(self.fit_index(load_training_data(self.training_file)['qa_pairs'], card_keys))
+            return None
+
+        changed = [name for name, key in card_keys.items() if old_keys.get(name) != key]
+        changed += [name for name in old_keys if name not in card_keys]
+        updates = load_card_qa_pairs(self.training_file, changed)
+        self.update_cards(updates, card_keys)
+        return list(updates)
+
+    @property
+    def training_data(self):
+        # Only parsed when something needs the raw QA pairs
+        if self._training_data is None:
+            self._training_data = load_training_data(self.training_file)
+        return self._training_data
     
-    def get_answer(self, user_question):
-        # Vectorize user question
+    def get_top_k(self, user_question, k=5, card=None, preferred_card=None):
+        """Return up to k matching questions above the similarity threshold, best first.
+
+        With card (named in the message), only that card's rows are searched,
+        falling back to every card when none of them reaches the threshold. With
+        preferred_card (carried over from earlier turns), every card is searched and
+        the preferred card's rows are used only when they are a near-tie.
+        """
         question_vector = self.vectorizer.transform([user_question])
-        
-        # Calculate similarities
-        similarities = cosine_similarity(question_vector, self.question_vectors)
-        
-        # Get most similar question index
-        most_similar_idx = np.argmax(similarities)
-        similarity_score = similarities[0][most_similar_idx]
-        
-        if similarity_score < 0.3:  # Threshold for similarity
+        scope_card = card or preferred_card
+        scope = self.index.card_rows(scope_card) if scope_card else None
+        rows = ()
+        if scope is not None:
+            rows, scores = self.search_rows(question_vector, k, scope)
+        if len(rows) == 0 or card is None:
+            global_rows, global_scores = self.search_rows(question_vector, k)
+            if len(rows) == 0 or scores[0] < global_scores[0] - self.card_preference_margin:
+                rows, scores = global_rows, global_scores
+        return [
+            {
+                "answer": self.answers[idx],
+                "similar_question": self.questions[idx],
+                "similarity": float(score),
+                "index": int(idx)
+            }
+            for idx, score in zip(rows, scores)
+        ]
+
+    def search_rows(self, question_vector, k, rows=None):
+        stats = {}
+        result = self.index.search(question_vector, k, self.similarity_threshold, stats, rows)
+        self.metrics.count("retrieval_candidates", stats.get("candidates", 0))
+        return result
+
+    def get_top_k_many(self, user_questions, k=5, chunk_size=128):
+        """get_top_k for a list or iterator of questions, yielded in order.
+
+        Each chunk is scored with one sparse product against the inverted index,
+        so memory is bounded by chunk_size rather than the number of questions.
+        """
+        postings = self.index.postings
+        for chunk in iter_chunks(user_questions, chunk_size):
+            scores = (self.vectorizer.transform(chunk) @ postings).tocsr()
+            for row in range(len(chunk)):
+                start, end = scores.indptr[row], scores.indptr[row + 1]
+                self.metrics.count("retrieval_candidates", int(end - start))
+                rows, row_scores = scores.indices[start:end], scores.data[start:end]
+                keep = row_scores >= self.similarity_threshold
+                rows, row_scores = select_top_k(rows[keep], row_scores[keep], k)
+                yield [
+                    {
+                        "answer": self.answers[idx],
+                        "similar_question": self.questions[idx],
+                        "similarity": float(score),
+                        "index": int(idx)
+                    }
+                    for idx, score in zip(rows, row_scores)
+                ]
+
+    def get_answer(self, user_question, card=None, preferred_card=None):
+        # Score only questions sharing a term with the user question
+        return self.format_matches(self.get_top_k(user_question, 1, card, preferred_card))
+
+    def get_answers(self, user_questions, chunk_size=128):
+        """Batch get_answer: yields one result per question, in order"""
+        for matches in self.get_top_k_many(user_questions, 1, chunk_size):
+            yield self.format_matches(matches)
+
+    def format_matches(self, matches):
+        if not matches:
             return "Xin lỗi, tôi không hiểu câu hỏi của bạn."
-        
+
+        best = matches[0]
         return {
-            "answer": self.answers[most_similar_idx],
-            "similar_question": self.questions[most_similar_idx],
-            "similarity": float(similarity_score)
+            "answer": best["answer"],
+            "similar_question": best["similar_question"],
+            "similarity": best["similarity"]
         }
 
 class EnhancedCardBot(SimpleCardBot):
-    def __init__(self):
-        super().__init__()
-        self.encoder = SentenceTransformer('vinai/phobert-base')
-        self.tokenizer = AutoTokenizer.from_pretrained('vinai/phobert-base')
-        self.conversation_history = []
-        self.context = {
-            "current_card": None,
-            "last_intent": None,
-            "questions_asked": []
-        }
-        
-        # Thêm danh sách thẻ
-        self.available_cards = [
-            "HDBank Vietjet Platinum",
-            "HDBank Petrolimex 4in1",
-            "HDBank Vietjet Classic",
-            "HDBank Priority Visa Signature",
-            "HDBank JCB Ultimate",
-            "HDBank Best Friend Forever",
-            "HDBank Visa Gold",
-            "HDBank Visa Classic",
-            "HDBank Mastercard Standard",
-            "HDBank Mastercard Platinum",
-            "HDBank Mastercard World",
+    encoder_name = 'vinai/phobert-base'
+    dense_threshold = 0.5
+    retrieval_modes = ("tfidf", "dense", "ivf", "hybrid")
 
-        ]
+    # Hybrid cascade: TF-IDF candidates, embedding rerank of the top N only
+    rerank_top_n = 20
+    sparse_weight = 0.4
+    dense_weight = 0.6
+    decisive_margin = 0.2
+    # Messages starting with a digit are menu selections (numbers are validated against the catalog)
+    menu_prefixes = tuple("123456789")
+
+    def __init__(self, training_file='training_data.json', index_dir=None, intent_cache_file=None,
+                 retrieval_mode="tfidf", session_store=None, fast_path=True, warm_up=False,
+                 response_cache=None, metrics=None, encoder=None, compact_tolerance=None,
+                 encoder_name=None, encoder_quantize=False, encoder_threads=None, encoder_max_seq_length=None):
+        super().__init__(training_file, index_dir, metrics, compact_tolerance)
+        if retrieval_mode not in self.retrieval_modes:
+            raise ValueError(f"Unknown retrieval mode: {retrieval_mode}")
+        self.retrieval_mode = retrieval_mode
+        self.dense_index = None
+        self._last_query = (None, None)
+
+        # The sentence encoder and pattern embeddings are loaded on first semantic use
+        # (an encoder object with the same encode() API can be passed in instead)
+        self._encoder = encoder
+        # An injected encoder identifies its embeddings with a cache_key attribute
+        # (None: nothing is cached on disk). Wrapping the encoder later, as the chat
+        # service's batcher does, keeps the key.
+        self._injected_encoder = encoder is not None
+        self._injected_encoder_key = getattr(encoder, "cache_key", None)
+        if encoder_name:
+            self.encoder_name = encoder_name
+        # CPU inference: int8 dynamic quantization, torch thread count and token truncation
+        # for short chat messages (None keeps the model's defaults). Set before anything
+        # is encoded, since the dense and intent caches are keyed on them.
+        self.encoder_quantize = encoder_quantize
+        self.encoder_threads = encoder_threads
+        self.encoder_max_seq_length = encoder_max_seq_length
+        self._pattern_embeddings = None
+        self._model_lock = threading.RLock()
+        self.intent_cache_file = intent_cache_file
+
+        # Per-user state lives in the session store; the models and index above are shared.
+        # Calls without a session id use a private default session.
+        self.sessions = session_store if session_store is not None else SessionStore()
+        self.default_session = SessionState(None, self.sessions.max_turns)
+        self.context = self.default_session.context
+        self.conversation_history = self.default_session.history
+
+        # Intent and retrieval results keyed on normalized text and resolved card
+        self.response_cache = response_cache if response_cache is not None else ResponseCache()
+        
+        # Danh sách thẻ lấy từ dữ liệu: card catalog built once from the index rows
+        with self.startup_profile.stage("card catalog"):
+            self.catalog = CardCatalog.from_index(self.index)
+        self.available_cards = self.catalog.names
 
         # Add support responses
         self.support_responses = {
-            "initial": "Xin chào! Tôi có thể tư vấn cho bạn về các loại thẻ sau:\n" + \
-                      "\n".join([f"{idx+1}. Thẻ {card}" for idx, card in enumerate(self.available_cards)]) + \
-                      "\n\nBạn có thể chọn số thứ tự thẻ hoặc hỏi trực tiếp về thẻ bạn quan tâm.",
+            "initial": self.card_menu(),
             "ask_card": "Bạn muốn tìm hiểu về thẻ nào? Vui lòng chọn số thứ tự hoặc tên thẻ.",
             "invalid_number": "Số thứ tự không hợp lệ. Vui lòng chọn số từ 1 đến {}"
         }
+        self.support_phrases = ["cần hỗ trợ", "tư vấn", "giúp đỡ"]
 
         # Enhanced intent patterns
         self.intents = {
@@ -122,6 +344,32 @@ class EnhancedCardBot(SimpleCardBot):
             ["card_info", "benefits"],
             ["card_info", "fees"]
         ]
+
+        # Encode every intent pattern once instead of on every message
+        self.build_intent_index()
+        with self.startup_profile.stage("keyword matcher"):
+            self.build_keyword_matcher()
+
+        # Exact-match answers for known questions, checked before any model work.
+        # Entries whose intent needs the encoder get it on their first hit (or all
+        # at once in warm_up()). With an index_dir the table is saved with the index.
+        self.fast_path_lookups = 0
+        self.fast_path_hits = 0
+        self.fast_path = None
+        if fast_path:
+            with self.startup_profile.stage("fast path"):
+                self.fast_path = self.load_fast_path()
+                if self.fast_path is None:
+                    self.fast_path = self.build_fast_path(resolve_semantic=False)
+                    self.save_fast_path()
+
+        if self.retrieval_mode != "tfidf":
+            with self.startup_profile.stage("dense index"):
+                self.get_dense_index()
+
+        self.warm_up_thread = None
+        if warm_up:
+            self.start_warm_up()
         
         self.responses = {
             "greeting": [
@@ -144,39 +392,469 @@ class EnhancedCardBot(SimpleCardBot):
         # Add more Vietnamese-specific normalization if needed
         return text
 
+    @property
+    def encoder(self):
+        if self._encoder is None:
+            with self._model_lock:
+                if self._encoder is None:
+                    self._encoder = self.load_encoder()
+        return self._encoder
+
+    @encoder.setter
+    def encoder(self, encoder):
+        self._encoder = encoder
+
+    def load_encoder(self):
+        with self.startup_profile.stage("import sentence_transformers"):
+            import sentence_transformers  # noqa: F401
+        with self.startup_profile.stage("load encoder model"):
+            return load_sentence_encoder(self.encoder_name, self.encoder_quantize, self.encoder_threads,
+                                         self.encoder_max_seq_length)
+
+    @property
+    def encoder_key(self):
+        """Cache key of the embeddings: quantized or truncated encoders embed differently"""
+        if self._injected_encoder:
+            return self._injected_encoder_key
+        return encoder_key(self.encoder_name, self.encoder_quantize, self.encoder_max_seq_length)
+
+    @property
+    def pattern_embeddings(self):
+        if self._pattern_embeddings is None:
+            with self._model_lock:
+                if self._pattern_embeddings is None:
+                    with self.startup_profile.stage("intent embeddings"):
+                        self._pattern_embeddings = self.load_pattern_embeddings()
+        return self._pattern_embeddings
+
+    def warm_up(self):
+        """Load the encoder and intent embeddings and complete the fast-path table"""
+        self.encoder
+        self.pattern_embeddings
+        if self.fast_path is not None:
+            with self.startup_profile.stage("fast path (semantic intents)"):
+                self.fast_path = self.complete_fast_path(self.fast_path)
+
+    def start_warm_up(self):
+        """Run warm_up() on a background thread so the bot can serve TF-IDF answers meanwhile"""
+        self.warm_up_thread = threading.Thread(target=self.warm_up, name="bot-warm-up", daemon=True)
+        self.warm_up_thread.start()
+        return self.warm_up_thread
+
+    def startup_report(self):
+        return self.startup_profile.report()
+
+    def encode_texts(self, texts):
+        """Encode a list of texts into a float32 embedding matrix"""
+        self.metrics.count("encoder_calls")
+        return np.asarray(self.encoder.encode(list(texts)), dtype=np.float32).reshape(len(texts), -1)
+
+    def embed_query(self, text):
+        """Encode the user text once per request and reuse it across stages"""
+        last_text, last_embedding = self._last_query
+        if last_text == text:
+            return last_embedding
+        embedding = normalize_rows(self.encode_texts([text]))[0]
+        self._last_query = (text, embedding)
+        return embedding
+
+    def get_dense_index(self):
+        """Open the float16 question embeddings, building them if missing or stale"""
+        if self.dense_index is None:
+            key = self.encoder_key
+            path = dense_index_path(self.training_file, self.index.row_fingerprint, key)
+            if key is not None:
+                self.dense_index = DenseIndex.load(path, self.training_file, key,
+                                                   self.index.row_fingerprint, len(self.questions))
+            if self.dense_index is None:
+                questions = [self.preprocess_text(q) for q in self.questions]
+                self.dense_index = DenseIndex.build(self.encode_texts, questions)
+                if self.retrieval_mode == "ivf":
+                    self.dense_index.build_ivf()
+                if key is not None:
+                    self.dense_index.save(path, self.training_file, key, self.index.row_fingerprint)
+        return self.dense_index
+
+    def replace_index(self, index, kept_rows=None):
+        old_fast_path, old_questions, old_cards = self.fast_path, self.questions, self.available_cards
+        super().replace_index(index, kept_rows)
+
+        # The card list, menu and card keywords follow the data
+        self.catalog = CardCatalog.from_index(index)
+        self.available_cards = self.catalog.names
+        self.support_responses["initial"] = self.card_menu()
+        cards_changed = self.available_cards != old_cards
+        if cards_changed:
+            self.build_keyword_matcher()
+
+        # Re-encode only the new rows when the old rows were carried over
+        if self.dense_index is not None:
+            path = dense_index_path(self.training_file, self.index.row_fingerprint, self.encoder_key)
+            if kept_rows is None:
+                self.dense_index = None
+                self.get_dense_index()
+            else:
+                new_questions = [self.preprocess_text(q) for q in self.questions[len(kept_rows):]]
+                embeddings = np.asarray(self.dense_index.embeddings)[kept_rows]
+                if new_questions:
+                    embeddings = np.vstack([embeddings, DenseIndex.build(self.encode_texts, new_questions).embeddings])
+                self.dense_index = DenseIndex(embeddings)
+                if self.retrieval_mode == "ivf":
+                    self.dense_index.build_ivf()
+                if self.encoder_key is not None:
+                    self.dense_index.save(path, self.training_file, self.encoder_key, self.index.row_fingerprint)
+
+        # Keep the entries of carried-over rows; semantic intents depend only on the
+        # text, so recomputed keys keep theirs too
+        if old_fast_path is not None:
+            base = None
+            # (menu numbers and card hits in the old table are stale if the card list changed)
+            if kept_rows is not None and not cards_changed:
+                removed = np.setdiff1d(np.arange(len(old_questions)), kept_rows)
+                removed_keys = {self.preprocess_text(old_questions[row]) for row in removed}
+                base = {key: entry for key, entry in old_fast_path.items() if key not in removed_keys}
+            table = self.build_fast_path(resolve_semantic=False, table=base)
+            for key, entry in table.items():
+                old = old_fast_path.get(key)
+                if entry.intent is None and old is not None and old.intent is not None:
+                    table[key] = entry._replace(intent=old.intent)
+            self.fast_path = self.complete_fast_path(table) if self._pattern_embeddings is not None else table
+            self.save_fast_path()
+
+    def retrieve(self, text, user_input, card=None, preferred_card=None, query_embedding=None):
+        """Answer retrieval for the configured mode; same result shape as SimpleCardBot.get_answer.
+
+        A card named in the message scopes the search to its rows, with a global
+        fallback; a preferred card from the session only breaks near-ties.
+        query_embedding is the normalized embedding of text, if already computed.
+        """
+        if self.retrieval_mode == "tfidf":
+            return SimpleCardBot.get_answer(self, user_input, card, preferred_card)
+        if self.retrieval_mode == "hybrid":
+            return self.retrieve_hybrid(text, user_input, card, preferred_card, query_embedding)
+
+        query = self.embed_query(text) if query_embedding is None else query_embedding
+        scope_card = card or preferred_card
+        scope = self.index.card_rows(scope_card) if scope_card else None
+        rows = ()
+        if scope is not None:
+            rows, scores = self.search_dense(query, scope)
+        if len(rows) == 0 or card is None:
+            global_rows, global_scores = self.search_dense(query)
+            if len(rows) == 0 or (len(global_rows) and scores[0] < global_scores[0] - self.card_preference_margin):
+                rows, scores = global_rows, global_scores
+        if len(rows) == 0:
+            return "Xin lỗi, tôi không hiểu câu hỏi của bạn."
+        return {
+            "answer": self.answers[rows[0]],
+            "similar_question": self.questions[rows[0]],
+            "similarity": float(scores[0])
+        }
+
+    def search_dense(self, query, rows=None):
+        """Best row of the embedding search (IVF for an unscoped search in ivf mode)"""
+        dense = self.get_dense_index()
+        stats = {}
+        if rows is None and self.retrieval_mode == "ivf":
+            result = dense.search_ivf(query, 1, self.dense_threshold, stats=stats)
+        else:
+            result = dense.search(query, 1, self.dense_threshold, rows, stats)
+        self.metrics.count("retrieval_candidates", stats.get("candidates", 0))
+        return result
+
+    def build_intent_index(self):
+        """Lay out intent patterns grouped by intent for the pattern embedding matrix"""
+        patterns = []
+        self.intent_names = list(self.intents.keys())
+        # Patterns are stored grouped by intent, so each intent is a contiguous block
+        self.intent_offsets = []
+        for intent in self.intent_names:
+            self.intent_offsets.append(len(patterns))
+            patterns.extend(self.intents[intent])
+        self.intent_offsets = np.array(self.intent_offsets)
+        self.intent_patterns = patterns
+
+    def load_pattern_embeddings(self):
+        """Normalized pattern embeddings, from the cache file if it matches the patterns"""
+        cache_file = self.intent_cache_file if self.encoder_key is not None else None
+        if cache_file:
+            try:
+                cached = np.load(cache_file, allow_pickle=False)
+                if list(cached['patterns']) == self.intent_patterns and str(cached['encoder']) == self.encoder_key:
+                    return cached['embeddings']
+            except (OSError, KeyError, ValueError):
+                pass
+
+        embeddings = normalize_rows(self.encode_texts(self.intent_patterns))
+        if cache_file:
+            np.savez(cache_file, patterns=np.array(self.intent_patterns), embeddings=embeddings,
+                     encoder=np.array(self.encoder_key))
+        return embeddings
+
+    def retrieve_hybrid(self, text, user_input, card=None, preferred_card=None, query_embedding=None):
+        """Two-stage retrieval: TF-IDF top-N candidates, reranked with cached question embeddings"""
+        candidates = self.get_top_k(user_input, self.rerank_top_n, card, preferred_card)
+        if not candidates:
+            return "Xin lỗi, tôi không hiểu câu hỏi của bạn."
+
+        best = candidates[0]
+        # Skip the encoder when stage one is already decisive
+        if len(candidates) > 1 and best["similarity"] - candidates[1]["similarity"] < self.decisive_margin:
+            rows = np.array([c["index"] for c in candidates])
+            question_embeddings = np.asarray(self.get_dense_index().embeddings[rows], dtype=np.float32)
+            self.metrics.count("retrieval_candidates", len(rows))
+            query = self.embed_query(text) if query_embedding is None else query_embedding
+            dense_scores = question_embeddings @ query
+            sparse_scores = np.array([c["similarity"] for c in candidates])
+            fused = self.sparse_weight * sparse_scores + self.dense_weight * dense_scores
+            best = candidates[int(np.argmax(fused))]
+
+        return {
+            "answer": best["answer"],
+            "similar_question": best["similar_question"],
+            "similarity": best["similarity"]
+        }
+
+    def build_keyword_matcher(self):
+        """One automaton for intent keywords, card names and support phrases"""
+        self.keyword_matcher = KeywordMatcher()
+        for intent, patterns in self.intents.items():
+            for pattern in patterns:
+                self.keyword_matcher.add(pattern, "intent", intent)
+        for idx, card in enumerate(self.available_cards):
+            # Users often drop the bank name ("thẻ vietjet platinum")
+            for alias in card_aliases(card):
+                self.keyword_matcher.add(alias, "card", idx)
+        for phrase in self.support_phrases:
+            self.keyword_matcher.add(phrase, "support")
+        self.keyword_matcher.build()
+
+    def card_hits(self, text, hits):
+        """Catalog indexes of the cards named in text, ignoring names cut off mid-word
+        ("visa gold 1" inside "visa gold 12")"""
+        return [
+            hit.value for hit in hits
+            if hit.category == "card" and not (hit.end < len(text) and text[hit.end].isalnum())
+        ]
+
+    def build_fast_path(self, resolve_semantic=True, table=None):
+        """Map normalized texts (menu numbers, training questions) to precomputed replies.
+
+        Without resolve_semantic, entries whose intent needs the encoder are stored
+        with intent None, filled in on their first hit or by complete_fast_path().
+        Entries already in table are kept; only questions missing from it are scanned.
+        """
+        table = dict(table or {})
+        for idx, card in enumerate(self.available_cards):
+            table[str(idx + 1)] = FastPathEntry("card_number", None, None, card)
+
+        menu_prefixes = self.menu_prefixes
+        pending = {}
+        row_card_names = [self.index.card_names[c] if c >= 0 else None for c in np.asarray(self.index.row_cards).tolist()]
+        for question, answer, answer_card in zip(self.questions, self.answers, row_card_names):
+            key = self.preprocess_text(question)
+            if not key or key in table or key in pending or key.startswith(menu_prefixes):
+                continue
+            hits = self.keyword_matcher.find_all(key)
+            card_hits = self.card_hits(key, hits)
+            if any(hit.category == "support" for hit in hits) and not card_hits:
+                table[key] = FastPathEntry("menu", self.support_responses["initial"], None, None)
+                continue
+            card = self.available_cards[min(card_hits)] if card_hits else None
+            pending[key] = (answer, card, answer_card)
+
+        for key, (answer, card, answer_card) in pending.items():
+            intent = self.get_keyword_intent(self.keyword_matcher.find_all(key))
+            table[key] = FastPathEntry("answer", answer, intent, card, answer_card)
+        return self.complete_fast_path(table) if resolve_semantic else table
+
+    def complete_fast_path(self, table):
+        """Return a copy of table with the missing semantic intents filled in"""
+        keys = [key for key, entry in table.items() if entry.kind == "answer" and entry.intent is None]
+        completed = dict(table)
+        for key, intent in zip(keys, self.get_intents(keys)):
+            completed[key] = table[key]._replace(intent=intent)
+        return completed
+
+    def fast_path_config(self):
+        """Digest of the settings besides the index rows that build_fast_path() depends on"""
+        config = [FAST_PATH_FORMAT_VERSION, self.intents, self.multi_intent_patterns, self.support_phrases,
+                  self.available_cards, list(self.menu_prefixes)]
+        return hashlib.sha256(json.dumps(config, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+    def save_fast_path(self):
+        """Write the menu and answer entries to index_dir (menu numbers are rebuilt on load).
+
+        Answers and cards are stored as ids into the index tables, and only keyword
+        intents are kept, since semantic ones depend on the encoder.
+        """
+        if not self.index_dir or self.fast_path is None:
+            return
+        answer_ids = {answer: idx for idx, answer in enumerate(self.answers.table)}
+        card_ids = {name: idx for idx, name in enumerate(self.index.card_names)}
+        menu, keys, answers, cards, answer_cards, multi_intent = [], [], [], [], [], []
+        for key, entry in self.fast_path.items():
+            if entry.kind == "menu":
+                menu.append(key)
+            elif entry.kind == "answer" and entry.answer in answer_ids:
+                keys.append(key)
+                answers.append(answer_ids[entry.answer])
+                cards.append(card_ids.get(entry.card, -1))
+                answer_cards.append(card_ids.get(entry.answer_card, -1))
+                multi_intent.append(entry.intent == "multi_intent")
+
+        path = os.path.join(self.index_dir, FAST_PATH_FILE)
+        tmp_path = f"{path}.tmp-{os.getpid()}.npz"
+        np.savez(tmp_path, rows=np.array(self.index.row_fingerprint), config=np.array(self.fast_path_config()),
+                 menu=np.array(menu, dtype=str), keys=np.array(keys, dtype=str),
+                 answers=np.array(answers, dtype=np.int32), cards=np.array(cards, dtype=np.int32),
+                 answer_cards=np.array(answer_cards, dtype=np.int32), multi_intent=np.array(multi_intent, dtype=bool))
+        os.replace(tmp_path, path)
+
+    def load_fast_path(self):
+        """The table saved by save_fast_path(), or None if missing or built from other rows or settings"""
+        if not self.index_dir:
+            return None
+        try:
+            saved = np.load(os.path.join(self.index_dir, FAST_PATH_FILE), allow_pickle=False)
+            if str(saved['rows']) != self.index.row_fingerprint or str(saved['config']) != self.fast_path_config():
+                return None
+            menu, keys = saved['menu'].tolist(), saved['keys'].tolist()
+            answer_ids, card_ids = saved['answers'].tolist(), saved['cards'].tolist()
+            answer_card_ids, multi_intent = saved['answer_cards'].tolist(), saved['multi_intent'].tolist()
+        except (OSError, KeyError, ValueError):
+            return None
+
+        table = {str(idx + 1): FastPathEntry("card_number", None, None, card)
+                 for idx, card in enumerate(self.available_cards)}
+        for key in menu:
+            table[key] = FastPathEntry("menu", self.support_responses["initial"], None, None)
+        answers = list(self.answers.table)
+        card_names = list(self.index.card_names) + [None]  # id -1 is no card
+        for key, answer, card, answer_card, multi in zip(keys, answer_ids, card_ids, answer_card_ids, multi_intent):
+            table[key] = FastPathEntry("answer", answers[answer], "multi_intent" if multi else None,
+                                       card_names[card], card_names[answer_card])
+        return table
+
+    def export_metrics(self, fmt="prometheus"):
+        """Stage histograms and counters plus cache/fast-path/session gauges"""
+        gauges = {f"fast_path_{k}": v for k, v in self.fast_path_stats().items()}
+        gauges.update({f"response_cache_{k}": v for k, v in self.cache_stats().items()})
+        gauges.update({f"session_{k}": v for k, v in self.sessions.stats().items()})
+        if fmt == "jsonl":
+            return self.metrics.export_jsonl(gauges)
+        return self.metrics.export_prometheus(gauges)
+
+    def cache_stats(self):
+        return self.response_cache.stats()
+
+    def fast_path_stats(self):
+        lookups = self.fast_path_lookups
+        return {
+            "lookups": lookups,
+            "hits": self.fast_path_hits,
+            "hit_rate": self.fast_path_hits / lookups if lookups else 0.0
+        }
+
+    def fast_path_applies(self, entry, context):
+        """Whether a precomputed entry gives the reply the full path would in this context"""
+        if entry.kind != "answer":
+            return True
+        # The stored answer came from a global search; a scoped search agrees only
+        # when the scope is the answer's own card or has no rows at all
+        card = entry.card or context["current_card"]
+        return card is None or card == entry.answer_card or self.index.card_rows(card) is None
+
+    def resolve_fast_path_intent(self, text, entry, batch=None):
+        """Fill in the semantic intent of an entry on its first hit and keep it in the table"""
+        intent = batch[0] if batch is not None else self.get_intent(text)
+        entry = entry._replace(intent=intent)
+        self.fast_path[text] = entry
+        return entry
+
+    def answer_from_fast_path(self, entry, user_input, session):
+        context = session.context
+        if entry.kind == "menu":
+            return entry.answer
+        if entry.kind == "card_number":
+            context["current_card"] = entry.card
+            return f"Thông tin về {entry.card}:\n{self.get_card_info(entry.card)}"
+
+        if entry.card:
+            context["current_card"] = entry.card
+        mentioned_card = entry.card or context["current_card"]
+        answer = self.format_response(
+            entry.answer,
+            entry.intent,
+            {"card_name": mentioned_card} if mentioned_card else None
+        )
+        context["last_intent"] = entry.intent
+        self.sessions.record_turn(session, {
+            "user": user_input,
+            "bot": answer,
+            "intent": entry.intent,
+            "card": mentioned_card,
+            "timestamp": datetime.now()
+        })
+        return answer
+
     def get_semantic_similarity(self, text1, text2):
         # Use sentence embeddings for better matching
-        emb1 = self.encoder.encode(text1)
-        emb2 = self.encoder.encode(text2)
-        return cosine_similarity([emb1], [emb2])[0][0]
-        
-    def get_intent(self, text):
-        text = text.lower()
+        emb1, emb2 = normalize_rows(self.encode_texts([text1, text2]))
+        return float(emb1 @ emb2)
         
-        # Check for multiple intents first
-        found_intents = []
-        for intent, patterns in self.intents.items():
-            if any(pattern in text for pattern in patterns):
-                found_intents.append(intent)
+    def get_keyword_intent(self, hits):
+        """Return "multi_intent" if the keyword hits match a known combination, else None"""
+        matched = {hit.value for hit in hits if hit.category == "intent"}
+        found_intents = [intent for intent in self.intents if intent in matched]
         
         # If multiple intents found, check if it matches known combinations
         if len(found_intents) > 1:
             for combo in self.multi_intent_patterns:
                 if all(intent in found_intents for intent in combo):
                     return "multi_intent"
+        return None
+
+    def get_intent(self, text, hits=None):
+        text = text.lower()
+        if hits is None:
+            hits = self.keyword_matcher.find_all(text)
         
-        # For single intent, use semantic similarity
-        max_similarity = 0
-        chosen_intent = "general_query"
-        
-        for intent, patterns in self.intents.items():
-            for pattern in patterns:
-                similarity = self.get_semantic_similarity(text, pattern)
-                if similarity > max_similarity:
-                    max_similarity = similarity
-                    chosen_intent = intent
+        # Check for multiple intents first
+        with self.metrics.stage("keyword_intent"):
+            keyword_intent = self.get_keyword_intent(hits)
+        if keyword_intent:
+            return keyword_intent
         
-        return chosen_intent
+        # For single intent, use semantic similarity against all patterns at once
+        with self.metrics.stage("semantic_intent"):
+            return self.get_semantic_intent(self.embed_query(text))
+
+    def embed_queries(self, texts, batch_size=256):
+        """Normalized embeddings of texts, encoded batch_size at a time"""
+        texts = list(texts)
+        return [
+            embedding for start in range(0, len(texts), batch_size)
+            for embedding in normalize_rows(self.encode_texts(texts[start:start + batch_size]))
+        ]
+
+    def get_intents(self, texts, batch_size=256):
+        """Batched get_intent: texts needing the encoder are encoded together"""
+        texts = [text.lower() for text in texts]
+        intents = [self.get_keyword_intent(self.keyword_matcher.find_all(text)) for text in texts]
+        pending = [idx for idx, intent in enumerate(intents) if intent is None]
+        for idx, embedding in zip(pending, self.embed_queries([texts[idx] for idx in pending], batch_size)):
+            intents[idx] = self.get_semantic_intent(embedding)
+        return intents
+
+    def get_semantic_intent(self, text_embedding):
+        similarities = self.pattern_embeddings @ text_embedding
+        intent_scores = np.maximum.reduceat(similarities, self.intent_offsets)
+
+        best = int(np.argmax(intent_scores))
+        if intent_scores[best] <= 0:
+            return "general_query"
+        return self.intent_names[best]
         
     def get_card_metadata(self, question):
         # Dummy implementation, replace with actual logic
@@ -195,21 +873,124 @@ class EnhancedCardBot(SimpleCardBot):
         
         return answer
         
-    def get_answer(self, user_input: str) -> str:
+    def get_session(self, session_id=None):
+        if session_id is None:
+            return self.default_session
+        return self.sessions.get(session_id)
+
+    def get_answer(self, user_input: str, session_id=None) -> str:
+        with self.metrics.request():
+            return self._get_answer(user_input, session_id)
+
+    def get_answers(self, user_inputs, session_id=None, chunk_size=128):
+        """Batch get_answer over a list or iterator, yielding replies in order.
+
+        Per chunk, messages are encoded once, in batches, for both the intents and
+        dense retrieval (in TF-IDF mode retrieval is one sparse product); the
+        conversation logic then runs message by message so session context
+        evolves exactly as with get_answer.
+        """
+        for chunk in iter_chunks(user_inputs, chunk_size):
+            prefetched = self.prefetch(chunk)
+            for user_input in chunk:
+                with self.metrics.request():
+                    yield self._get_answer(user_input, session_id, prefetched)
+
+    def prefetch(self, user_inputs):
+        """Intent and retrieval results for the messages that will need them, keyed like the cache"""
+        pending = {}
+        menu_prefixes = self.menu_prefixes
+        for user_input in user_inputs:
+            text = self.preprocess_text(user_input)
+            key = self.cache_text(text)
+            if key in pending or text.startswith(menu_prefixes):
+                continue
+            if self.fast_path is not None:
+                entry = self.fast_path.get(text)
+                if entry is not None and (entry.kind != "answer" or entry.intent is not None):
+                    continue
+            hits = self.keyword_matcher.find_all(text.lower())
+            card_hits = self.card_hits(text, hits)
+            if any(hit.category == "support" for hit in hits) and not card_hits:
+                continue
+            # Only a card named in the message is known here; one carried over in the
+            # session context is resolved (and retrieved for) message by message
+            card = self.available_cards[min(card_hits)] if card_hits else None
+            # Repeats answered from the response cache need no model work
+            if self.response_cache.contains((key, card), self.data_version):
+                continue
+            pending[key] = (text, user_input, card, self.get_keyword_intent(hits))
+
+        # One encoder pass serves the semantic intents and dense retrieval (hybrid
+        # reranking of a keyword-intent message still encodes it on demand)
+        dense = self.retrieval_mode in ("dense", "ivf")
+        needed = [dense or intent is None for _, _, _, intent in pending.values()]
+        encoded = iter(self.embed_queries(text for (text, _, _, _), need in zip(pending.values(), needed) if need))
+        embeddings = [next(encoded) if need else None for need in needed]
+        intents = [
+            intent or self.get_semantic_intent(embedding)
+            for (_, _, _, intent), embedding in zip(pending.values(), embeddings)
+        ]
+
+        unscoped = [user_input for _, user_input, card, _ in pending.values() if card is None]
+        if self.retrieval_mode == "tfidf":
+            unscoped = iter(self.get_answers_tfidf(unscoped))
+        else:
+            unscoped = (
+                self.retrieve(text, user_input, query_embedding=embedding)
+                for (text, user_input, card, _), embedding in zip(pending.values(), embeddings) if card is None
+            )
+        return {
+            key: (intent, card,
+                  next(unscoped) if card is None else self.retrieve(text, user_input, card, query_embedding=embedding),
+                  embedding)
+            for (key, (text, user_input, card, _)), intent, embedding in zip(pending.items(), intents, embeddings)
+        }
+
+    def get_answers_tfidf(self, user_inputs):
+        return SimpleCardBot.get_answers(self, user_inputs)
+
+    def cache_text(self, text):
+        # Punctuation and spacing are dropped from cache keys; TF-IDF ignores them anyway
+        return " ".join(re.findall(r"\w+", text))
+
+    def _get_answer(self, user_input, session_id, prefetched=None):
+        metrics = self.metrics
+        session = self.get_session(session_id)
+        context = session.context
+
         # Preprocess input
-        text = self.preprocess_text(user_input)
-        intent = self.get_intent(text)
+        with metrics.stage("preprocess"):
+            text = self.preprocess_text(user_input)
+
+        batch = prefetched.get(self.cache_text(text)) if prefetched else None
+
+        # Known questions are answered straight from the lookup table
+        if self.fast_path is not None:
+            self.fast_path_lookups += 1
+            entry = self.fast_path.get(text)
+            if entry is not None and self.fast_path_applies(entry, context):
+                if entry.kind == "answer" and entry.intent is None:
+                    entry = self.resolve_fast_path_intent(text, entry, batch)
+                self.fast_path_hits += 1
+                metrics.count("fast_path_hits")
+                return self.answer_from_fast_path(entry, user_input, session)
+
+        # Single pass over the text for intent keywords, card names and support phrases
+        with metrics.stage("keyword_scan"):
+            hits = self.keyword_matcher.find_all(text.lower())
+            card_hits = self.card_hits(text, hits)
 
         # Handle support requests
-        if any(phrase in text.lower() for phrase in ["cần hỗ trợ", "tư vấn", "giúp đỡ"]):
-            if not any(card.lower() in text.lower() for card in self.available_cards):
+        if any(hit.category == "support" for hit in hits):
+            if not card_hits:
                 return self.support_responses["initial"]
 
         # Handle card number selection
-        if text.startswith(tuple(str(i) for i in range(1, len(self.available_cards) + 1))):
+        if text.startswith(self.menu_prefixes):
             selected_card = self.get_card_by_number(text.split()[0])
             if selected_card:
-                self.context["current_card"] = selected_card
+                context["current_card"] = selected_card
                 # Get card description from training data
                 card_info = self.get_card_info(selected_card)
                 return f"Thông tin về {selected_card}:\n{card_info}"
@@ -217,29 +998,49 @@ class EnhancedCardBot(SimpleCardBot):
                 return self.support_responses["invalid_number"].format(len(self.available_cards))
 
         # Check if question is about a specific card
-        mentioned_card = None
-        for card in self.available_cards:
-            if card.lower() in text.lower():
-                mentioned_card = card
-                self.context["current_card"] = card
-                break
-
-        # If no card mentioned, use the last card from context
-        if not mentioned_card and self.context["current_card"]:
-            mentioned_card = self.context["current_card"]
-
-        # Get answer using parent class method
-        response = super().get_answer(user_input)
+        with metrics.stage("card_detection"):
+            named_card = None
+            if card_hits:
+                # First card in catalog order, as before
+                named_card = self.available_cards[min(card_hits)]
+                context["current_card"] = named_card
+
+            # If no card mentioned, use the last card from context
+            mentioned_card = named_card or context["current_card"]
+
+        # Repeated questions reuse the cached intent and retrieval result
+        cache_key = (self.cache_text(text), mentioned_card)
+        cached = self.response_cache.get(cache_key, self.data_version)
+        if cached is not None:
+            metrics.count("response_cache_hits")
+            intent, response = cached
+        else:
+            intent = batch[0] if batch is not None else self.get_intent(text, hits)
+            if batch is not None and batch[1] == mentioned_card:
+                response = batch[2]
+            else:
+                # Get answer from the configured retrieval backend: scoped to a card named
+                # here, or preferring the session's card on near-ties
+                with metrics.stage("retrieval"):
+                    embedding = batch[3] if batch is not None else None
+                    if named_card:
+                        response = self.retrieve(text, user_input, named_card, query_embedding=embedding)
+                    else:
+                        response = self.retrieve(text, user_input, preferred_card=mentioned_card,
+                                                 query_embedding=embedding)
+            self.response_cache.put(cache_key, (intent, response), self.data_version)
         
         if isinstance(response, dict):
-            answer = self.format_response(
-                response['answer'],
-                intent,
-                {"card_name": mentioned_card} if mentioned_card else None
-            )
+            with metrics.stage("format_response"):
+                answer = self.format_response(
+                    response['answer'],
+                    intent,
+                    {"card_name": mentioned_card} if mentioned_card else None
+                )
             
             # Update conversation history
-            self.conversation_history.append({
+            context["last_intent"] = intent
+            self.sessions.record_turn(session, {
                 "user": user_input,
                 "bot": answer,
                 "intent": intent,
@@ -251,50 +1052,50 @@ class EnhancedCardBot(SimpleCardBot):
         
         return response
 
+    def card_menu(self):
+        return "Xin chào! Tôi có thể tư vấn cho bạn về các loại thẻ sau:\n" + \
+               self.catalog.menu() + \
+               "\n\nBạn có thể chọn số thứ tự thẻ hoặc hỏi trực tiếp về thẻ bạn quan tâm."
+
     def get_card_by_number(self, number: str) -> str:
-        try:
-            idx = int(number) - 1
-            if 0 <= idx < len(self.available_cards):
-                return self.available_cards[idx]
-        except ValueError:
-            return None
-        return None
+        entry = self.catalog.by_number(number)
+        return entry.name if entry else None
 
     def get_card_info(self, card_name: str) -> str:
         """Get basic information about a specific card"""
-        # Find card info in training data
-        for qa in self.training_data['qa_pairs']:
-            if qa['metadata'].get('card_name') == card_name and 'description' in qa['context']:
-                return qa['answer']
+        entry = self.catalog.get(card_name)
+        if entry and entry.description is not None:
+            return entry.description
         return f"Xin lỗi, tôi không tìm thấy thông tin về thẻ {card_name}"
 
-    def update_conversation(self, user_input, response):
-        self.conversation_history.append({
+    def update_conversation(self, user_input, response, session_id=None):
+        # History is a bounded ring buffer, so old turns drop off automatically
+        self.sessions.record_turn(self.get_session(session_id), {
             "user": user_input,
             "bot": response
         })
-        if len(self.conversation_history) > 5:
-            self.conversation_history.pop(0)
 
-    def update_context(self, user_input):
+    def update_context(self, user_input, session_id=None):
         # Dummy implementation, replace with actual logic
-        self.context["last_intent"] = self.get_intent(user_input)
-        self.context["questions_asked"].append(user_input)
+        context = self.get_session(session_id).context
+        context["last_intent"] = self.get_intent(user_input)
+        context["questions_asked"].append(user_input)
 
-    def manage_conversation(self, user_input, response):
+    def manage_conversation(self, user_input, response, session_id=None):
         # Track conversation state
-        self.update_context(user_input)
+        session = self.get_session(session_id)
+        self.update_context(user_input, session_id)
         
         # Handle multi-turn conversations
-        if self.context["last_intent"] == "card_info":
+        if session.context["last_intent"] == "card_info":
             # Add relevant follow-up responses
             pass
             
         # Save conversation history
-        self.conversation_history.append({
+        self.sessions.record_turn(session, {
             "user": user_input,
             "bot": response,
-            "intent": self.context["last_intent"],
+            "intent": session.context["last_intent"],
             "timestamp": datetime.now()
         })
 
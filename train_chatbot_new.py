@@ -1,7 +1,18 @@
+import argparse
+import hashlib
 import json
+import multiprocessing as mp
+import os
+import shutil
+from itertools import islice
 from typing import List, Dict
 import numpy as np
 
+SHARD_FORMAT_VERSION = 1
+SHARD_MANIFEST = 'manifest.json'
+# Bump whenever the QA generation below changes, so cached card expansions are regenerated
+GENERATOR_VERSION = 1
+
 def generate_qa_pairs(card_data: Dict) -> List[Dict]:
     """Generate question-answer pairs from card data"""
     qa_pairs = []
@@ -85,7 +96,7 @@ def generate_qa_pairs(card_data: Dict) -> List[Dict]:
 
     return qa_pairs
 
-def generate_greeting_qa_pairs():
+def generate_greeting_qa_pairs(rng=np.random):
     """Generate greeting and farewell training data"""
     qa_pairs = []
     
@@ -113,7 +124,7 @@ def generate_greeting_qa_pairs():
     for pattern in greeting_patterns:
         qa_pairs.append({
             "question": pattern,
-            "answer": np.random.choice(responses["greeting"]),
+            "answer": rng.choice(responses["greeting"]),
             "context": "greeting",
             "metadata": {"type": "greeting"}
         })
@@ -127,14 +138,14 @@ def generate_greeting_qa_pairs():
     for pattern in farewell_patterns:
         qa_pairs.append({
             "question": pattern, 
-            "answer": np.random.choice(responses["farewell"]),
+            "answer": rng.choice(responses["farewell"]),
             "context": "farewell",
             "metadata": {"type": "farewell"}
         })
 
     return qa_pairs
 
-def enhance_answer(answer: str, context: str) -> str:
+def enhance_answer(answer: str, context: str, rng=np.random) -> str:
     """Add natural language elements to answers"""
     prefixes = {
         "card_description": [
@@ -160,7 +171,7 @@ def enhance_answer(answer: str, context: str) -> str:
     }
     
     if context in prefixes:
-        prefix = np.random.choice(prefixes[context])
+        prefix = rng.choice(prefixes[context])
         return f"{prefix}{answer}"
     return answer
 
@@ -195,11 +206,71 @@ def generate_variations(question: str) -> List[str]:
             if not any(p in variant.lower() for p in polite_prefixes):
                 variations.append(f"{prefix} {variant}")
     
-    return list(set(variations))
+    # Drop duplicates but keep a stable order (set order changes with the hash seed)
+    return list(dict.fromkeys(variations))
+
+def card_info(card: Dict) -> Dict:
+    """Flatten one scraped card record into the fields generate_qa_pairs expects"""
+    return {
+        'card_name': card['metadata']['card_name'],
+        'card_type': card['metadata']['card_type'],
+        'description': card.get('description', ''),
+        'features': {
+            'benefits': card.get('features', {}).get('benefits', []),
+            'gifts': card.get('features', {}).get('gifts', []),
+            'privileges': card.get('features', {}).get('privileges', [])
+        },
+        'terms_and_conditions': {
+            'conditions': card.get('terms_and_conditions', {}).get('conditions', ''),
+            'fees': card.get('terms_and_conditions', {}).get('fees', ''),
+            'documents': card.get('terms_and_conditions', {}).get('documents', '')
+        },
+        'faqs': card.get('faqs', {})
+    }
+
+def expand_card(card: Dict, rng=np.random) -> List[Dict]:
+    """All training QA pairs for one scraped card: base pairs, their variations and enhanced answers"""
+    qa_pairs = []
+
+    # Generate variations and enhance answers
+    for qa in generate_qa_pairs(card_info(card)):
+        base_question = qa['question']
+        question_variations = generate_variations(base_question)
+        enhanced_answer = enhance_answer(qa['answer'], qa['context'], rng)
+
+        # Add each variation as a separate QA pair
+        for variant in question_variations:
+            qa_pairs.append({
+                "question": variant,
+                "answer": enhanced_answer,
+                "context": qa['context'],
+                "metadata": qa['metadata']
+            })
+
+        # If there are specific variations in the QA pair, add those too
+        if 'variations' in qa:
+            for variant in qa['variations']:
+                qa_pairs.append({
+                    "question": variant,
+                    "answer": enhanced_answer,
+                    "context": qa['context'],
+                    "metadata": qa['metadata']
+                })
 
-def create_training_data():
+    return qa_pairs
+
+def dataset_info(total_qa_pairs: int) -> Dict:
+    return {
+        "name": "HDBank Cards QA Dataset",
+        "version": "1.0",
+        "description": "Question-Answer pairs about HDBank credit cards",
+        "language": "vi",
+        "total_qa_pairs": total_qa_pairs
+    }
+
+def create_training_data(input_file='training_card_data.json', output_file='training_data.json'):
     # Load scraped data
-    with open('training_card_data.json', 'r', encoding='utf-8') as f:
+    with open(input_file, 'r', encoding='utf-8') as f:
         data = json.load(f)
     
     all_qa_pairs = []
@@ -209,68 +280,287 @@ def create_training_data():
     
     # Process each card
     for card in data['cards_data']:
-        card_info = {
-            'card_name': card['metadata']['card_name'],
-            'card_type': card['metadata']['card_type'],
-            'description': card.get('description', ''),
-            'features': {
-                'benefits': card.get('features', {}).get('benefits', []),
-                'gifts': card.get('features', {}).get('gifts', []),
-                'privileges': card.get('features', {}).get('privileges', [])
-            },
-            'terms_and_conditions': {
-                'conditions': card.get('terms_and_conditions', {}).get('conditions', ''),
-                'fees': card.get('terms_and_conditions', {}).get('fees', ''),
-                'documents': card.get('terms_and_conditions', {}).get('documents', '')
-            },
-            'faqs': card.get('faqs', {})
-        }
-        
-        # Get base QA pairs for this card
-        card_qa_pairs = generate_qa_pairs(card_info)
-        
-        # Generate variations and enhance answers
-        for qa in card_qa_pairs:
-            base_question = qa['question']
-            question_variations = generate_variations(base_question)
-            enhanced_answer = enhance_answer(qa['answer'], qa['context'])
-            
-            # Add each variation as a separate QA pair
-            for variant in question_variations:
-                all_qa_pairs.append({
-                    "question": variant,
-                    "answer": enhanced_answer,
-                    "context": qa['context'],
-                    "metadata": qa['metadata']
-                })
-            
-            # If there are specific variations in the QA pair, add those too
-            if 'variations' in qa:
-                for variant in qa['variations']:
-                    all_qa_pairs.append({
-                        "question": variant,
-                        "answer": enhanced_answer,
-                        "context": qa['context'],
-                        "metadata": qa['metadata']
-                    })
+        all_qa_pairs.extend(expand_card(card))
     
     # Create final training data structure
     training_data = {
-        "dataset_info": {
-            "name": "HDBank Cards QA Dataset",
-            "version": "1.0",
-            "description": "Question-Answer pairs about HDBank credit cards",
-            "language": "vi",
-            "total_qa_pairs": len(all_qa_pairs)
-        },
+        "dataset_info": dataset_info(len(all_qa_pairs)),
         "qa_pairs": all_qa_pairs
     }
     
     # Save training data
-    with open('training_data.json', 'w', encoding='utf-8') as f:
+    with open(output_file, 'w', encoding='utf-8') as f:
         json.dump(training_data, f, ensure_ascii=False, indent=4)
     
     print(f"Generated {len(all_qa_pairs)} QA pairs for training")
 
+def iter_cards(input_file: str, buffer_size: int = 1 << 16):
+    """Yield scraped cards one at a time without loading the whole file.
+
+    Accepts the scraped {"cards_data": [...]} document, or JSONL with one card per line.
+    """
+    with open(input_file, 'r', encoding='utf-8') as f:
+        if input_file.endswith('.jsonl'):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+            return
+
+        # Skip ahead to the opening bracket of the cards_data array
+        buffer = ''
+        while True:
+            chunk = f.read(buffer_size)
+            if not chunk:
+                raise ValueError(f"{input_file} has no cards_data array")
+            buffer += chunk
+            key = buffer.find('"cards_data"')
+            start = buffer.find('[', key) if key >= 0 else -1
+            if start >= 0:
+                buffer = buffer[start + 1:]
+                break
+
+        # Decode one card object at a time, reading more only when a card is cut off
+        decoder = json.JSONDecoder()
+        pos = 0
+        while True:
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                pos += 1
+            if pos < len(buffer) and buffer[pos] == ']':
+                return
+            try:
+                if pos == len(buffer):
+                    raise ValueError("need more input")
+                card, pos = decoder.raw_decode(buffer, pos)
+            except ValueError:
+                chunk = f.read(buffer_size)
+                if not chunk:
+                    raise ValueError(f"{input_file} ends inside the cards_data array")
+                buffer, pos = buffer[pos:] + chunk, 0
+                continue
+            yield card
+            if pos >= buffer_size:
+                buffer, pos = buffer[pos:], 0
+
+def card_key(card: Dict, seed: int = 0) -> str:
+    """Content hash of a scraped card record, the generator version and the seed"""
+    record = json.dumps(card, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(f"{GENERATOR_VERSION}:{seed}:{record}".encode('utf-8')).hexdigest()
+
+def encode_qa_pairs(qa_pairs: List[Dict]) -> bytes:
+    return "".join(json.dumps(qa, ensure_ascii=False) + "\n" for qa in qa_pairs).encode('utf-8')
+
+def _expand_job(job):
+    # Seeded from the card's content, so the output does not depend on the worker
+    # count, the card's position in the catalog, or whether it came from the cache.
+    # Rows are serialized in the worker too, and stay encoded from here on.
+    key, card = job
+    return encode_qa_pairs(expand_card(card, np.random.RandomState(int(key[:8], 16))))
+
+class ExpansionCache:
+    """Encoded JSONL rows per card_key, one file each; a cache_dir of None disables caching"""
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def get(self, key):
+        if not self.cache_dir:
+            return None
+        try:
+            with open(os.path.join(self.cache_dir, key + '.jsonl'), 'rb') as f:
+                rows = f.read()
+        except OSError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return rows
+
+    def put(self, key, rows):
+        if not self.cache_dir:
+            return
+        path = os.path.join(self.cache_dir, key + '.jsonl')
+        with open(f"{path}.tmp-{os.getpid()}", 'wb') as f:
+            f.write(rows)
+        os.replace(f"{path}.tmp-{os.getpid()}", path)
+
+class ShardWriter:
+    """Write encoded JSONL rows into numbered shards of about shard_size lines.
+
+    A card's rows are never split across shards, so each card can be read back
+    with one seek (see load_card_qa_pairs).
+    """
+
+    def __init__(self, output_dir: str, shard_size: int):
+        self.output_dir = output_dir
+        self.shard_size = shard_size
+        self.shards = []
+        self._file = None
+
+    def write(self, rows: bytes) -> Dict:
+        """Append one card's rows and return where they landed"""
+        if self._file is None or self.shards[-1]["qa_pairs"] >= self.shard_size:
+            self.close()
+            name = f"qa-{len(self.shards):05d}.jsonl"
+            self._file = open(os.path.join(self.output_dir, name), 'wb')
+            self.shards.append({"file": name, "qa_pairs": 0})
+        offset = self._file.tell()
+        self._file.write(rows)
+        count = rows.count(b"\n")
+        self.shards[-1]["qa_pairs"] += count
+        return {"shard": len(self.shards) - 1, "offset": offset, "length": len(rows), "qa_pairs": count}
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+def create_training_shards(input_file='training_card_data.json', output_dir='training_shards', workers=None,
+                           seed=0, shard_size=50000, batch_size=256, cache_dir=None):
+    """Streaming, parallel create_training_data writing JSONL shards plus a manifest.
+
+    Cards are read incrementally and expanded batch by batch across a process pool,
+    so memory stays bounded by batch_size whatever the catalog size. The output is
+    the same for a given seed regardless of the number of workers. With cache_dir,
+    cards whose content key is already cached are copied instead of regenerated.
+    """
+    tmp_dir = f"{output_dir.rstrip(os.sep)}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    workers = workers or os.cpu_count()
+    pool = mp.get_context('fork').Pool(workers) if workers > 1 else None
+    writer = ShardWriter(tmp_dir, shard_size)
+    cache = ExpansionCache(cache_dir)
+    cards_manifest = []
+    total = 0
+    try:
+        total += writer.write(encode_qa_pairs(generate_greeting_qa_pairs(np.random.RandomState(seed))))["qa_pairs"]
+
+        cards = iter_cards(input_file)
+        while True:
+            batch = [(card_key(card, seed), card) for card in islice(cards, batch_size)]
+            if not batch:
+                break
+            cached = [cache.get(key) for key, _ in batch]
+            jobs = [job for job, rows in zip(batch, cached) if rows is None]
+            generated = iter(pool.map(_expand_job, jobs, chunksize=max(1, len(jobs) // (4 * workers))) if pool
+                             else map(_expand_job, jobs))
+            for (key, card), rows in zip(batch, cached):
+                if rows is None:
+                    rows = next(generated)
+                    cache.put(key, rows)
+                location = writer.write(rows)
+                total += location["qa_pairs"]
+                cards_manifest.append({"name": card['metadata']['card_name'], "key": key, **location})
+    finally:
+        writer.close()
+        if pool:
+            pool.close()
+            pool.join()
+
+    manifest = {
+        "format_version": SHARD_FORMAT_VERSION,
+        "dataset_info": dataset_info(total),
+        "generator_version": GENERATOR_VERSION,
+        "seed": seed,
+        "cards": cards_manifest,
+        "shards": writer.shards
+    }
+    # Manifest last: a directory without one is an incomplete build
+    with open(os.path.join(tmp_dir, SHARD_MANIFEST), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=4)
+
+    if os.path.isdir(output_dir):
+        shutil.rmtree(output_dir)
+    os.rename(tmp_dir, output_dir)
+
+    print(f"Generated {total} QA pairs for training in {len(writer.shards)} shards"
+          + (f" ({cache.hits} cards reused, {cache.misses} regenerated)" if cache_dir else ""))
+    return manifest
+
+def iter_qa_pairs(path: str):
+    """Stream QA pairs from either a training_data.json file or a shard directory"""
+    if not os.path.isdir(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            yield from json.load(f)['qa_pairs']
+        return
+    with open(os.path.join(path, SHARD_MANIFEST), 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    for shard in manifest["shards"]:
+        with open(os.path.join(path, shard["file"]), 'r', encoding='utf-8') as f:
+            for line in f:
+                yield json.loads(line)
+
+def load_card_keys(path: str):
+    """{card_name: content key} recorded by create_training_shards, or None for a plain JSON file"""
+    if not os.path.isdir(path):
+        return None
+    with open(os.path.join(path, SHARD_MANIFEST), 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    keys = {}
+    for card in manifest.get("cards", []):
+        # Cards sharing a name are replaced together
+        keys[card["name"]] = f'{keys[card["name"]]},{card["key"]}' if card["name"] in keys else card["key"]
+    return keys
+
+def load_card_qa_pairs(path: str, card_names) -> Dict[str, List[Dict]]:
+    """{card_name: qa_pairs} for the given cards of a shard directory, reading only their rows"""
+    with open(os.path.join(path, SHARD_MANIFEST), 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    qa_pairs = {name: [] for name in card_names}
+    for card in manifest.get("cards", []):
+        if card["name"] not in qa_pairs:
+            continue
+        with open(os.path.join(path, manifest["shards"][card["shard"]]["file"]), 'rb') as f:
+            f.seek(card["offset"])
+            rows = f.read(card["length"])
+        qa_pairs[card["name"]].extend(json.loads(line) for line in rows.splitlines())
+    return qa_pairs
+
+def intern_qa_pairs(qa_pairs):
+    """Make rows share one object per distinct answer, context and metadata dict.
+
+    Every variation of a question repeats its answer and metadata, so this keeps
+    one copy of each instead of one per row.
+    """
+    strings = {}
+    metadata = {}
+    for qa in qa_pairs:
+        qa['answer'] = strings.setdefault(qa['answer'], qa['answer'])
+        if 'context' in qa:
+            qa['context'] = strings.setdefault(qa['context'], qa['context'])
+        if 'metadata' in qa:
+            key = tuple(sorted(qa['metadata'].items()))
+            qa['metadata'] = metadata.setdefault(key, qa['metadata'])
+        yield qa
+
+def load_training_data(path: str) -> Dict:
+    """training_data.json contents, also for a shard directory written by create_training_shards"""
+    if not os.path.isdir(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            training_data = json.load(f)
+        training_data['qa_pairs'] = list(intern_qa_pairs(training_data['qa_pairs']))
+        return training_data
+    with open(os.path.join(path, SHARD_MANIFEST), 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    return {"dataset_info": manifest["dataset_info"], "qa_pairs": list(intern_qa_pairs(iter_qa_pairs(path)))}
+
 if __name__ == "__main__":
-    create_training_data()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Build chatbot training data from scraped card data")
+    parser.add_argument('--input', default='training_card_data.json')
+    parser.add_argument('--output', default='training_data.json')
+    parser.add_argument('--shards', metavar='DIR', help="stream JSONL shards into DIR instead of one JSON file")
+    parser.add_argument('--workers', type=int, help="worker processes for --shards (default: all CPUs)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--shard-size', type=int, default=50000)
+    parser.add_argument('--cache-dir', help="reuse the QA pairs of unchanged cards from this directory")
+    args = parser.parse_args()
+
+    if args.shards:
+        create_training_shards(args.input, args.shards, args.workers, args.seed, args.shard_size,
+                               cache_dir=args.cache_dir)
+    else:
+        create_training_data(args.input, args.output)
@@ -0,0 +1,133 @@
+# worker_pool.py
+import argparse
+import json
+import multiprocessing as mp
+import os
+import resource
+import time
+
+from test_chatbot import SimpleCardBot
+
+
+def process_memory(pid=None):
+    """Resident and private (unshared) memory of a process in bytes"""
+    path = f"/proc/{pid or 'self'}/smaps_rollup"
+    try:
+        fields = {}
+        with open(path, 'r') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0].endswith(':') and parts[1].isdigit():
+                    fields[parts[0][:-1]] = int(parts[1]) * 1024
+        return {
+            "rss": fields.get("Rss", 0),
+            "pss": fields.get("Pss", 0),
+            "private": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0)
+        }
+    except OSError:
+        # Not Linux: only the peak RSS of this process is available
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        return {"rss": peak, "pss": peak, "private": peak}
+
+
+def _worker_main(training_file, index_dir, requests, results):
+    # The index files are memory-mapped, so every worker shares the same page cache
+    bot = SimpleCardBot(training_file, index_dir)
+    while True:
+        item = requests.get()
+        if item is None:
+            break
+        request_id, questions = item
+        results.put((request_id, list(bot.get_answers(questions))))
+
+
+class WorkerPool:
+    """Pre-fork pool of SimpleCardBot workers attached to one read-only on-disk index"""
+
+    def __init__(self, training_file='training_data.json', index_dir='training_index', workers=None,
+                 chunk_size=64):
+        self.chunk_size = chunk_size
+        self.training_file = training_file
+        self.index_dir = index_dir
+        # Build (or validate) the index once in the parent, before forking
+        SimpleCardBot(training_file, index_dir)
+
+        context = mp.get_context('fork')
+        self.requests = context.Queue()
+        self.results = context.Queue()
+        self.workers = [
+            context.Process(target=_worker_main, args=(training_file, index_dir, self.requests, self.results),
+                            daemon=True)
+            for _ in range(workers or os.cpu_count())
+        ]
+        for worker in self.workers:
+            worker.start()
+        self._next_id = 0
+
+    def get_answers(self, questions):
+        """Answer questions across the workers, returning results in input order"""
+        questions = list(questions)
+        # Ship questions in chunks so queue overhead does not dominate short queries
+        chunks = {}
+        for start in range(0, len(questions), self.chunk_size):
+            chunks[self._next_id] = start
+            self.requests.put((self._next_id, questions[start:start + self.chunk_size]))
+            self._next_id += 1
+
+        answers = [None] * len(questions)
+        for _ in range(len(chunks)):
+            request_id, chunk_answers = self.results.get()
+            start = chunks[request_id]
+            answers[start:start + len(chunk_answers)] = chunk_answers
+        return answers
+
+    def get_answer(self, question):
+        return self.get_answers([question])[0]
+
+    def memory(self):
+        """Per-worker memory, read from /proc of each worker process"""
+        return [process_memory(worker.pid) for worker in self.workers]
+
+    def close(self):
+        for _ in self.workers:
+            self.requests.put(None)
+        for worker in self.workers:
+            worker.join(timeout=5)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def benchmark(training_file='training_data.json', index_dir='training_index', worker_counts=(1, 2, 4),
+              n_queries=20000):
+    """Throughput and per-worker memory as the pool grows"""
+    bot = SimpleCardBot(training_file, index_dir)
+    queries = [bot.questions[i % len(bot.questions)] for i in range(n_queries)]
+    report = []
+    for workers in worker_counts:
+        with WorkerPool(training_file, index_dir, workers) as pool:
+            pool.get_answers(queries[:workers * 10])  # warm up every worker
+            start = time.perf_counter()
+            pool.get_answers(queries)
+            elapsed = time.perf_counter() - start
+            memory = pool.memory()
+        report.append({
+            "workers": workers,
+            "queries_per_second": n_queries / elapsed,
+            "rss_per_worker_mb": sum(m["rss"] for m in memory) / len(memory) / 2 ** 20,
+            "private_per_worker_mb": sum(m["private"] for m in memory) / len(memory) / 2 ** 20
+        })
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the pre-fork SimpleCardBot worker pool")
+    parser.add_argument('--training-file', default='training_data.json')
+    parser.add_argument('--index-dir', default='training_index')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--queries', type=int, default=20000)
+    args = parser.parse_args()
+    print(json.dumps(benchmark(args.training_file, args.index_dir, args.workers, args.queries), indent=4))